@@ -5,13 +5,15 @@ Production-ready with uvicorn ASGI server.
 """
 
 import argparse
+import os
 import signal
 import sys
 import threading
-import time
 import logging
 from datetime import datetime, timedelta
-from src.udpmonitor import MessageStorage, UDPListener, create_app
+from typing import Optional
+from src.udpmonitor import MessageStorage, UDPListener, create_app, create_app_from_env
+from src.udpmonitor.udp_listener import DEFAULT_SOCKET_BUFFER, exclude_cpu
 import uvicorn
 
 
@@ -25,7 +27,11 @@ class UDPMonitor:
         api_host: str = '0.0.0.0',
         api_port: int = 8880,
         db_path: str = 'udpmonitor.db',
-        retention_days: float = 1.0
+        retention_days: float = 1.0,
+        rcvbuf: int = DEFAULT_SOCKET_BUFFER,
+        sndbuf: int = DEFAULT_SOCKET_BUFFER,
+        workers: int = 1,
+        udp_cpu: Optional[int] = None
     ):
         """
         Initialize the UDP Monitor application.
@@ -37,19 +43,31 @@ class UDPMonitor:
             api_port: Port for REST API
             db_path: Path to SQLite database
             retention_days: Number of days to retain messages (default: 1.0)
+            rcvbuf: UDP socket receive buffer size in bytes
+            sndbuf: UDP socket send buffer size in bytes
+            workers: Number of uvicorn worker processes for the REST API
+            udp_cpu: CPU reserved for the UDP listener thread (None disables pinning)
         """
         self.storage = MessageStorage(db_path=db_path)
         self.udp_listener = UDPListener(
             host=udp_host,
             port=udp_port,
-            storage=self.storage
+            storage=self.storage,
+            rcvbuf=rcvbuf,
+            sndbuf=sndbuf,
+            cpu=udp_cpu
         )
-        self.app = create_app(self.storage)
+        # With several workers each worker process builds its own app
+        self.app = create_app(self.storage) if workers <= 1 else None
+        self.db_path = db_path
+        self.workers = workers
+        self.udp_cpu = udp_cpu
         self.api_host = api_host
         self.api_port = api_port
         self.retention_days = retention_days
         self.running = False
         self.cleanup_thread = None
+        self._cleanup_wake = threading.Event()
     
     def _cleanup_worker(self):
         """Background worker that runs nightly cleanup."""
@@ -57,20 +75,11 @@ class UDPMonitor:
             try:
                 # Calculate time until next midnight
                 now = datetime.now()
-                # Try today's midnight first
-                today_midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                
-                # If today's midnight is in the past, use tomorrow's midnight
-                if today_midnight <= now:
-                    next_midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-                else:
-                    next_midnight = today_midnight
-                
+                next_midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
                 sleep_seconds = (next_midnight - now).total_seconds()
                 
-                # Sleep until midnight
-                if sleep_seconds > 0:
-                    time.sleep(sleep_seconds)
+                # Sleep until midnight; stop() sets the event to wake us immediately
+                self._cleanup_wake.wait(timeout=sleep_seconds)
                 
                 if not self.running:
                     break
@@ -85,7 +94,7 @@ class UDPMonitor:
             except Exception as e:
                 print(f"[Cleanup] Error during cleanup: {e}")
                 # If there's an error, wait 1 hour before retrying
-                time.sleep(3600)
+                self._cleanup_wake.wait(timeout=3600)
     
     def start(self):
         """Start both the UDP listener and REST API."""
@@ -93,11 +102,16 @@ class UDPMonitor:
         print("UDP Monitor System")
         print("=" * 60)
         
+        # Keep this thread, and everything it starts (including the storage
+        # writer), off the listener's core; the listener thread pins itself
+        exclude_cpu(self.udp_cpu)
+        
         # Start UDP listener
         self.udp_listener.start()
         
         # Start cleanup thread
         self.running = True
+        self._cleanup_wake.clear()
         self.cleanup_thread = threading.Thread(target=self._cleanup_worker, daemon=True)
         self.cleanup_thread.start()
         print(f"Database cleanup scheduled: nightly deletion of messages older than {self.retention_days} day(s)")
@@ -113,19 +127,37 @@ class UDPMonitor:
         print("=" * 60)
         
         # Run uvicorn ASGI server
-        config = uvicorn.Config(
-            app=self.app,
+        server_options = dict(
             host=self.api_host,
             port=self.api_port,
             log_level="info",
-            access_log=True,
-            loop="asyncio"
+            # Per-request access logging is a significant cost at high request rates
+            access_log=False,
+            # uvloop and httptools come with uvicorn[standard]
+            loop="uvloop",
+            http="httptools"
         )
-        server = uvicorn.Server(config)
         
         try:
-            server.run()
+            if self.workers > 1:
+                # The UDP listener and cleanup thread must stay singletons, so
+                # they keep running in this supervisor process while each
+                # worker builds its own app and storage from DB_PATH
+                os.environ['DB_PATH'] = self.db_path
+                if self.udp_cpu is not None:
+                    os.environ['UDP_CPU'] = str(self.udp_cpu)
+                uvicorn.run(
+                    f"{create_app_from_env.__module__}:create_app_from_env",
+                    factory=True,
+                    workers=self.workers,
+                    **server_options
+                )
+            else:
+                server = uvicorn.Server(uvicorn.Config(app=self.app, **server_options))
+                server.run()
         except KeyboardInterrupt:
+            pass
+        finally:
             self.stop()
     
     def stop(self):
@@ -135,10 +167,22 @@ class UDPMonitor:
         
         print("\nShutting down...")
         self.running = False
+        self._cleanup_wake.set()
+        if self.cleanup_thread:
+            self.cleanup_thread.join(timeout=2)
         self.udp_listener.stop()
+        self.storage.close()
         print("UDP Monitor stopped")
 
 
+def default_udp_cpu() -> Optional[int]:
+    """Pick the last available CPU for the UDP listener, or None on single-CPU hosts."""
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    return cpus[-1] if len(cpus) > 1 else None
+
+
 def setup_logging(log_level: str = "INFO"):
     """Setup logging configuration."""
     logging.basicConfig(
@@ -164,6 +208,24 @@ def main():
         default=8888,
         help='Port for UDP listener (default: 8888)'
     )
+    parser.add_argument(
+        '--rcvbuf',
+        type=int,
+        default=DEFAULT_SOCKET_BUFFER,
+        help=f'UDP socket receive buffer size in bytes (default: {DEFAULT_SOCKET_BUFFER})'
+    )
+    parser.add_argument(
+        '--sndbuf',
+        type=int,
+        default=DEFAULT_SOCKET_BUFFER,
+        help=f'UDP socket send buffer size in bytes (default: {DEFAULT_SOCKET_BUFFER})'
+    )
+    parser.add_argument(
+        '--udp-cpu',
+        type=int,
+        default=default_udp_cpu(),
+        help='CPU to pin the UDP listener thread to, -1 to disable (default: last available CPU)'
+    )
     parser.add_argument(
         '--api-host',
         default='0.0.0.0',
@@ -210,7 +272,11 @@ def main():
         api_host=args.api_host,
         api_port=args.api_port,
         db_path=args.db_path,
-        retention_days=args.retention_days
+        retention_days=args.retention_days,
+        rcvbuf=args.rcvbuf,
+        sndbuf=args.sndbuf,
+        workers=args.workers,
+        udp_cpu=args.udp_cpu if args.udp_cpu is not None and args.udp_cpu >= 0 else None
     )
     
     # Handle graceful shutdown
@@ -5,7 +5,6 @@ This is the recommended way to run in production.
 """
 
 import argparse
-import subprocess
 import sys
 import os
 from pathlib import Path
@@ -62,14 +61,14 @@ def main():
     
     args = parser.parse_args()
     
-    # Set environment variables for the subprocess
-    env = os.environ.copy()
-    env['UDP_HOST'] = args.udp_host
-    env['UDP_PORT'] = str(args.udp_port)
-    env['API_HOST'] = args.api_host
-    env['API_PORT'] = str(args.api_port)
-    env['DB_PATH'] = args.db_path
-    env['RETENTION_DAYS'] = str(args.retention_days)
+    # Set environment variables for the worker processes; each worker builds
+    # its own app and storage from DB_PATH via create_app_from_env()
+    os.environ['UDP_HOST'] = args.udp_host
+    os.environ['UDP_PORT'] = str(args.udp_port)
+    os.environ['API_HOST'] = args.api_host
+    os.environ['API_PORT'] = str(args.api_port)
+    os.environ['DB_PATH'] = args.db_path
+    os.environ['RETENTION_DAYS'] = str(args.retention_days)
     
     # Get the directory of this script
     script_dir = Path(__file__).parent.absolute()
@@ -87,23 +86,24 @@ def main():
     print("or use the main.py script which handles everything together.")
     print("\nStarting uvicorn server...\n")
     
-    # Import and create the app
-    sys.path.insert(0, str(script_dir))
-    from storage import MessageStorage
-    from rest_api import create_app
+    # Make the udpmonitor package importable here and in the workers
+    src_dir = str(script_dir / 'src')
+    sys.path.insert(0, src_dir)
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [src_dir, os.environ.get('PYTHONPATH')]))
     
-    storage = MessageStorage(db_path=args.db_path)
-    app = create_app(storage)
-    
-    # Run uvicorn
+    # Run uvicorn; with workers the app must be given as an import string,
+    # so no storage is built in this supervisor process
     import uvicorn
     uvicorn.run(
-        app,
+        "udpmonitor.rest_api:create_app_from_env",
+        factory=True,
         host=args.api_host,
         port=args.api_port,
         workers=args.workers,
         log_level=args.log_level,
-        access_log=True
+        access_log=False,
+        loop="uvloop",
+        http="httptools"
     )
 
 if __name__ == '__main__':
@@ -14,12 +14,14 @@ RETENTION_DAYS=${RETENTION_DAYS:-1.0}
 WORKERS=${WORKERS:-4}
 LOG_LEVEL=${LOG_LEVEL:-INFO}
 
+# The udpmonitor package lives in src/; uvicorn workers read DB_PATH
+export PYTHONPATH="src${PYTHONPATH:+:$PYTHONPATH}"
+export DB_PATH
+
 # Start the UDP listener in background
 python3 -c "
 import sys
-sys.path.insert(0, '.')
-from storage import MessageStorage
-from udp_listener import UDPListener
+from udpmonitor import MessageStorage, UDPListener
 import threading
 import time
 import signal
@@ -31,6 +33,8 @@ listener.start()
 # Keep running
 def signal_handler(sig, frame):
     listener.stop()
+    # Write out messages still queued for the storage writer
+    storage.close()
     sys.exit(0)
 
 signal.signal(signal.SIGTERM, signal_handler)
@@ -44,8 +48,7 @@ UDP_PID=$!
 # Start cleanup worker in background
 python3 -c "
 import sys
-sys.path.insert(0, '.')
-from storage import MessageStorage
+from udpmonitor import MessageStorage
 import threading
 import time
 import signal
@@ -109,11 +112,14 @@ echo "REST API: http://$API_HOST:$API_PORT"
 echo "Workers: $WORKERS"
 echo "Log Level: $LOG_LEVEL"
 
-uvicorn rest_api:app \
+uvicorn udpmonitor.rest_api:create_app_from_env \
+    --factory \
     --host "$API_HOST" \
     --port "$API_PORT" \
     --workers "$WORKERS" \
     --log-level "$LOG_LEVEL" \
-    --access-log \
+    --loop uvloop \
+    --http httptools \
+    --no-access-log \
     --no-use-colors
 
@@ -0,0 +1,21 @@
+"""
+Build script for the optional compiled helpers.
+
+Project metadata lives in pyproject.toml. When Cython is available the
+_udpfetch_c extension is compiled; otherwise (or if compilation fails)
+udpmonitor installs as pure Python.
+"""
+
+from setuptools import Extension, setup
+
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    ext_modules = []
+else:
+    ext_modules = cythonize(
+        [Extension("udpmonitor._udpfetch_c", ["src/udpmonitor/_udpfetch_c.pyx"], optional=True)],
+        language_level=3,
+    )
+
+setup(ext_modules=ext_modules)
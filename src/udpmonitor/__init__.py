@@ -6,7 +6,7 @@ __version__ = "1.0.0"
 
 from .storage import MessageStorage
 from .udp_listener import UDPListener
-from .rest_api import create_app
+from .rest_api import create_app, create_app_from_env
 
-__all__ = ["MessageStorage", "UDPListener", "create_app"]
+__all__ = ["MessageStorage", "UDPListener", "create_app", "create_app_from_env"]
 
@@ -0,0 +1,83 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled row-to-Message construction for udpfetch.
+
+Optional: udpfetch falls back to its pure-Python _build_messages_py when
+this extension has not been built.
+"""
+
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_GET_SIZE
+from cpython.unicode cimport PyUnicode_DecodeUTF8
+from libc.stdio cimport snprintf
+
+from .storage import format_timestamp
+
+
+cdef str _format_timestamp(long long timestamp_us):
+    """Same output as storage.format_timestamp, without building a datetime."""
+    cdef long long seconds, days, secs_of_day, era, doe, yoe, doy, mp
+    cdef long long year, month, day, micros
+    cdef char buf[32]
+    cdef int n
+    
+    if timestamp_us < 0:
+        return format_timestamp(timestamp_us)
+    
+    seconds = timestamp_us // 1000000
+    micros = timestamp_us % 1000000
+    days = seconds // 86400
+    secs_of_day = seconds % 86400
+    
+    # Days since 1970-01-01 to a proleptic Gregorian date (H. Hinnant's civil_from_days)
+    days += 719468
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 if mp < 10 else mp - 9
+    year = yoe + era * 400 + (1 if month <= 2 else 0)
+    
+    # datetime.isoformat() omits the fraction when it is zero
+    if micros:
+        n = snprintf(buf, sizeof(buf), "%04lld-%02lld-%02lldT%02lld:%02lld:%02lld.%06lld",
+                     year, month, day, secs_of_day // 3600, secs_of_day // 60 % 60,
+                     secs_of_day % 60, micros)
+    else:
+        n = snprintf(buf, sizeof(buf), "%04lld-%02lld-%02lldT%02lld:%02lld:%02lld",
+                     year, month, day, secs_of_day // 3600, secs_of_day // 60 % 60,
+                     secs_of_day % 60)
+    return buf[:n].decode('ascii')
+
+
+cpdef list build_messages(object rows, object make):
+    """
+    Build Messages from (id, timestamp, client_ip, client_port, data, data_size) rows.
+    
+    Args:
+        rows: Iterable of row tuples, e.g. a sqlite3 cursor
+        make: Message._make
+        
+    Returns:
+        List of Message objects
+    """
+    cdef list messages = []
+    cdef tuple row
+    cdef bytes data
+    cdef str text
+    
+    for row in rows:
+        if type(row[4]) is not bytes:
+            # SQLite columns are dynamically typed (e.g. TEXT written by
+            # another tool); never read such values as bytes. The Python
+            # builder handles the row, so both paths behave the same.
+            from .udpfetch import _build_messages_py
+            messages.extend(_build_messages_py((row,), make))
+            continue
+        data = <bytes>row[4]
+        # Invalid UTF-8 (binary payloads) becomes U+FFFD, as in the Python path
+        text = PyUnicode_DecodeUTF8(PyBytes_AS_STRING(data), PyBytes_GET_SIZE(data), "replace")
+        messages.append(make((row[0], _format_timestamp(row[1]), row[2], row[3], text, data, row[5])))
+    
+    return messages
@@ -0,0 +1,278 @@
+"""
+ctypes bindings for the Linux recvmmsg()/sendmmsg() batch syscalls.
+Lets the UDP listener drain and echo many datagrams per syscall instead of one.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import sys
+from typing import Callable, List, Optional, Tuple
+
+
+# Number of datagrams fetched per recvmmsg() call
+BATCH_SIZE = 43
+
+# Maximum datagram size per buffer slot (larger datagrams are truncated)
+BUFFER_SIZE = 4096
+
+# Return once at least one datagram is available instead of waiting for a full batch
+MSG_WAITFORONE = 0x10000
+
+
+class iovec(ctypes.Structure):
+    """struct iovec from <sys/uio.h>."""
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class sockaddr_in(ctypes.Structure):
+    """struct sockaddr_in from <netinet/in.h> (IPv4 only)."""
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    """struct msghdr from <sys/socket.h>."""
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    """struct mmsghdr from <sys/socket.h>."""
+    _fields_ = [
+        ("msg_hdr", msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+def _load_libc_function(name: str, argtypes: list) -> Optional[Callable]:
+    """Look up a batch socket syscall wrapper in libc, or None if unavailable."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    func = getattr(libc, name, None)
+    if func is None:
+        return None
+    func.argtypes = argtypes
+    func.restype = ctypes.c_int
+    return func
+
+
+# int recvmmsg(int sockfd, struct mmsghdr *msgvec, unsigned int vlen, int flags, struct timespec *timeout)
+_recvmmsg = _load_libc_function(
+    'recvmmsg',
+    [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+)
+
+# int sendmmsg(int sockfd, struct mmsghdr *msgvec, unsigned int vlen, int flags)
+_sendmmsg = _load_libc_function(
+    'sendmmsg',
+    [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+)
+
+# True when recvmmsg() and sendmmsg() can be used on this platform
+AVAILABLE = _recvmmsg is not None and _sendmmsg is not None
+
+# Byte offsets used to read recvmmsg() results through memoryviews
+_MMSGHDR_SIZE = ctypes.sizeof(mmsghdr)
+_MSG_LEN_OFFSET = mmsghdr.msg_len.offset
+_SOCKADDR_IN_SIZE = ctypes.sizeof(sockaddr_in)
+_SIN_PORT_OFFSET = sockaddr_in.sin_port.offset
+_SIN_ADDR_OFFSET = sockaddr_in.sin_addr.offset
+_unpack_msg_len = struct.Struct('=I').unpack_from
+
+
+class RecvBatch:
+    """
+    Preallocated buffers for recvmmsg().
+
+    The datagram buffers, iovecs, source addresses and message headers are
+    allocated once and reused for every call. Payloads share one contiguous
+    block and, like the addresses and lengths, are read back through
+    memoryviews so extracting a datagram needs no ctypes call or struct
+    wrapper objects.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, buffer_size: int = BUFFER_SIZE):
+        """
+        Allocate the receive batch.
+
+        Args:
+            batch_size: Maximum number of datagrams per recvmmsg() call
+            buffer_size: Maximum size of a single datagram
+        """
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.payloads = bytearray(batch_size * buffer_size)
+        self.addrs = (sockaddr_in * batch_size)()
+        self.iovecs = (iovec * batch_size)()
+        self.msgs = (mmsghdr * batch_size)()
+
+        # Keep the exported ctypes view alive so the payload block cannot move
+        self._payload_buffer = (ctypes.c_char * len(self.payloads)).from_buffer(self.payloads)
+        self._payload_view = memoryview(self.payloads)
+        self._addr_view = memoryview(self.addrs).cast('B')
+        self._msg_view = memoryview(self.msgs).cast('B')
+
+        payload_base = ctypes.addressof(self._payload_buffer)
+        for i in range(batch_size):
+            self.iovecs[i].iov_base = payload_base + i * buffer_size
+            self.iovecs[i].iov_len = buffer_size
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.addrs[i])
+            hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+            hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            hdr.msg_iovlen = 1
+
+    def recv(self, sock: socket.socket, flags: int = MSG_WAITFORONE) -> int:
+        """
+        Receive up to batch_size datagrams from the socket.
+
+        Args:
+            sock: Bound IPv4 UDP socket
+            flags: recvmmsg() flags
+
+        Returns:
+            Number of datagrams received into the batch
+        """
+        while True:
+            count = _recvmmsg(sock.fileno(), ctypes.addressof(self.msgs), self.batch_size, flags, None)
+            if count >= 0:
+                return count
+            err = ctypes.get_errno()
+            if err != errno.EINTR:
+                raise OSError(err, os.strerror(err))
+
+    def packets(self, count: int) -> List[Tuple[bytes, Tuple[str, int]]]:
+        """
+        Get the first count received datagrams with their source addresses.
+
+        Each payload is copied out exactly once, because the batch buffers are
+        overwritten by the next recv() while the data may still be queued for
+        storage.
+
+        Args:
+            count: Number of datagrams returned by the last recv()
+
+        Returns:
+            List of (data, (client_ip, client_port)) tuples, like socket.recvfrom()
+        """
+        payload_view = self._payload_view
+        addr_view = self._addr_view
+        msg_view = self._msg_view
+        buffer_size = self.buffer_size
+        inet_ntoa = socket.inet_ntoa
+        from_bytes = int.from_bytes
+
+        packets = []
+        for i in range(count):
+            length = _unpack_msg_len(msg_view, i * _MMSGHDR_SIZE + _MSG_LEN_OFFSET)[0]
+            start = i * buffer_size
+            addr = i * _SOCKADDR_IN_SIZE
+            packets.append((
+                payload_view[start:start + length].tobytes(),
+                (
+                    inet_ntoa(addr_view[addr + _SIN_ADDR_OFFSET:addr + _SIN_ADDR_OFFSET + 4]),
+                    from_bytes(addr_view[addr + _SIN_PORT_OFFSET:addr + _SIN_PORT_OFFSET + 2], 'big'),
+                ),
+            ))
+        return packets
+
+
+class EchoBatch:
+    """
+    Preallocated sendmmsg() headers that echo a RecvBatch back to its senders.
+
+    Each message uses two iovecs: a shared prefix and the payload still sitting
+    in the receive buffer, so echoing needs no concatenation or copying.
+    """
+
+    def __init__(self, recv_batch: RecvBatch, prefix: bytes):
+        """
+        Allocate the echo batch.
+
+        Args:
+            recv_batch: Receive batch whose datagrams and addresses are echoed
+            prefix: Bytes prepended to every echoed datagram
+        """
+        self.recv_batch = recv_batch
+        self.prefix = ctypes.create_string_buffer(prefix, len(prefix))
+        self.iovecs = (iovec * (2 * recv_batch.batch_size))()
+        self.msgs = (mmsghdr * recv_batch.batch_size)()
+
+        for i in range(recv_batch.batch_size):
+            self.iovecs[2 * i].iov_base = ctypes.addressof(self.prefix)
+            self.iovecs[2 * i].iov_len = len(prefix)
+            self.iovecs[2 * i + 1].iov_base = recv_batch.iovecs[i].iov_base
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(recv_batch.addrs[i])
+            hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+            hdr.msg_iov = ctypes.pointer(self.iovecs[2 * i])
+            hdr.msg_iovlen = 2
+
+    def send(self, sock: socket.socket, count: int) -> int:
+        """
+        Echo the first count datagrams of the receive batch.
+
+        A datagram that fails to send (e.g. EMSGSIZE) is skipped so the rest of
+        the batch still goes out; the first such error is raised once the batch
+        is done. A full send buffer stops the batch at once: retrying each
+        remaining datagram would only fail again.
+
+        Args:
+            sock: Socket the datagrams were received on
+            count: Number of datagrams to echo
+
+        Returns:
+            Number of datagrams sent
+
+        Raises:
+            BlockingIOError: If the send buffer is full; the unsent rest of
+                the batch is dropped
+        """
+        for i in range(count):
+            self.iovecs[2 * i + 1].iov_len = self.recv_batch.msgs[i].msg_len
+
+        base = ctypes.addressof(self.msgs)
+        stride = ctypes.sizeof(mmsghdr)
+        offset = 0
+        sent_total = 0
+        first_error = None
+        while offset < count:
+            sent = _sendmmsg(sock.fileno(), base + offset * stride, count - offset, 0)
+            if sent > 0:
+                offset += sent
+                sent_total += sent
+                continue
+            err = ctypes.get_errno() if sent < 0 else errno.EIO
+            if err == errno.EINTR:
+                continue
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise BlockingIOError(err, os.strerror(err))
+            if first_error is None:
+                first_error = OSError(err, os.strerror(err))
+            offset += 1
+
+        if first_error is not None:
+            raise first_error
+        return sent_total
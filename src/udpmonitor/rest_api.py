@@ -4,11 +4,13 @@ Production-ready FastAPI application with uvicorn.
 """
 
 from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional
 from .storage import MessageStorage
+from .udp_listener import exclude_cpu
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +28,9 @@ def create_app(storage: MessageStorage) -> FastAPI:
     app = FastAPI(
         title="UDP Monitor API",
         description="REST API for querying stored UDP messages",
-        version="1.0.0"
+        version="1.0.0",
+        # orjson serializes large message lists several times faster than stdlib json
+        default_response_class=ORJSONResponse
     )
     
     # Add CORS middleware for production use
@@ -58,11 +62,12 @@ def create_app(storage: MessageStorage) -> FastAPI:
                 client_port=client_port
             )
             
-            return {
+            # Return the response directly to skip jsonable_encoder on every row
+            return ORJSONResponse({
                 'success': True,
                 'count': len(messages),
                 'messages': messages
-            }
+            })
         
         except Exception as e:
             logger.error(f"Error retrieving messages: {e}", exc_info=True)
@@ -85,44 +90,14 @@ def create_app(storage: MessageStorage) -> FastAPI:
     async def get_message(message_id: int):
         """GET endpoint to retrieve a specific message by ID."""
         try:
-            # Query database directly for better performance
-            import sqlite3
-            with storage.lock:
-                conn = sqlite3.connect(storage.db_path)
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT id, timestamp, client_ip, client_port, data, data_text, data_size FROM messages WHERE id = ?",
-                    (message_id,)
-                )
-                row = cursor.fetchone()
-                conn.close()
-            
-            if row:
-                # Format message like storage.get_messages does
-                if row['data_text']:
-                    message_text = row['data_text']
-                else:
-                    try:
-                        message_text = row['data'].decode('utf-8', errors='replace')
-                    except:
-                        message_text = row['data'].hex()
-                
-                message = {
-                    'id': row['id'],
-                    'timestamp': row['timestamp'],
-                    'client_ip': row['client_ip'],
-                    'client_port': row['client_port'],
-                    'data': message_text,
-                    'data_size': row['data_size']
-                }
-                
-                return {
-                    'success': True,
-                    'message': message
-                }
-            else:
+            message = storage.get_message_by_id(message_id)
+            if message is None:
                 raise HTTPException(status_code=404, detail='Message not found')
+            
+            return {
+                'success': True,
+                'message': message
+            }
         
         except HTTPException:
             raise
@@ -135,7 +110,9 @@ def create_app(storage: MessageStorage) -> FastAPI:
         """Health check endpoint."""
         return {
             'status': 'healthy',
-            'service': 'udpmonitor'
+            'service': 'udpmonitor',
+            # Messages received but not stored because the ingest queue was full
+            'dropped_count': storage.dropped_count
         }
     
     @app.post("/cleanup", response_model=dict)
@@ -164,3 +141,20 @@ def create_app(storage: MessageStorage) -> FastAPI:
     
     return app
 
+
+def create_app_from_env() -> FastAPI:
+    """
+    Create the application from environment configuration.
+    
+    Used as a uvicorn factory when running several worker processes: each
+    worker opens its own MessageStorage on the database named by DB_PATH
+    and stays off the CPU named by UDP_CPU, which is reserved for the
+    UDP listener.
+    
+    Returns:
+        Configured FastAPI application
+    """
+    udp_cpu = os.environ.get('UDP_CPU')
+    exclude_cpu(int(udp_cpu) if udp_cpu else None)
+    storage = MessageStorage(db_path=os.environ.get('DB_PATH', 'udpmonitor.db'))
+    return create_app(storage)
@@ -5,51 +5,228 @@ Uses SQLite to store datagrams with connection information.
 
 import sqlite3
 import json
+import logging
+import queue
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import threading
 
+logger = logging.getLogger(__name__)
+
+# Maximum number of messages waiting for the background writer
+INGEST_QUEUE_SIZE = 10000
+
+# Maximum number of messages written in one transaction
+WRITE_BATCH_SIZE = 500
+
+# Maximum time (seconds) the writer waits to fill a batch
+WRITE_BATCH_TIMEOUT = 0.05
+
+# Maximum number of messages removed per DELETE when purging old messages
+DELETE_BATCH_SIZE = 10000
+
+# Database page size; large pages keep most payloads out of overflow pages
+PAGE_SIZE = 16384
+
+# Maximum number of free pages returned to the OS after purging old messages
+VACUUM_PAGES = 1000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _build_select(filter_ip: bool, filter_port: bool) -> str:
+    """Build the get_messages() query for one combination of filters."""
+    query = "SELECT id, timestamp, client_ip, client_port, data, data_size FROM messages"
+    conditions = []
+    if filter_ip:
+        conditions.append("client_ip = ?")
+    if filter_port:
+        conditions.append("client_port = ?")
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return query + " ORDER BY timestamp DESC LIMIT ? OFFSET ?"
+
+
+# get_messages() queries keyed by (filter by IP, filter by port). Reusing the
+# exact same SQL strings lets sqlite3's statement cache skip re-preparing them.
+_SELECT_MESSAGES = {
+    (filter_ip, filter_port): _build_select(filter_ip, filter_port)
+    for filter_ip in (False, True)
+    for filter_port in (False, True)
+}
+
+
+def format_timestamp(timestamp_us: int) -> str:
+    """
+    Convert a stored timestamp to an ISO-8601 string.
+    
+    Args:
+        timestamp_us: Microseconds since the Unix epoch (UTC)
+        
+    Returns:
+        ISO-8601 UTC timestamp without timezone suffix
+    """
+    return (_EPOCH + timedelta(microseconds=timestamp_us)).isoformat()
+
 
 class MessageStorage:
-    """Thread-safe storage for UDP messages using SQLite."""
+    """
+    Thread-safe storage for UDP messages using SQLite.
+    
+    The database runs in WAL mode with one connection per thread, so reads
+    never block on writes. Writes are serialized by self.lock.
+    """
     
     def __init__(self, db_path: str = "udpmonitor.db"):
         """
         Initialize the storage.
         
         Args:
-            db_path: Path to SQLite database file
+            db_path: Path to SQLite database file, or a "file:" URI
         """
         self.db_path = db_path
         self.lock = threading.Lock()
+        self._tls = threading.local()
+        self.ingest_q = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self.dropped_count = 0
+        self._writer_thread = None
+        self._writer_start_lock = threading.Lock()
+        # Notified after every committed insert; see wait_for_count()
+        self.stored = threading.Condition()
         self._init_db()
     
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Get the calling thread's database connection.
+        
+        Each thread opens one connection on first use and reuses it for its
+        lifetime, avoiding a connect/close and cold page cache per call.
+        """
+        conn = getattr(self._tls, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, uri=True)
+            conn.row_factory = sqlite3.Row
+            # Per-connection settings; journal_mode=WAL is persisted by _init_db
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA wal_autocheckpoint=1000")
+            conn.execute("PRAGMA mmap_size=268435456")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-65536")
+            # Deleted rows need not be overwritten with zeros
+            conn.execute("PRAGMA secure_delete=OFF")
+            self._tls.conn = conn
+        return conn
+    
+    def _close_conn(self):
+        """Close the calling thread's database connection, if it has one."""
+        conn = getattr(self._tls, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._tls.conn = None
+    
     def _init_db(self):
         """Initialize the database schema."""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._conn()
             cursor = conn.cursor()
+            # Page size and auto-vacuum mode can only be chosen before the
+            # first table is created (and before switching to WAL); on an
+            # existing database both statements are no-ops
+            cursor.execute(f"PRAGMA page_size={PAGE_SIZE}")
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL lets readers run concurrently with the writer; the mode is
+            # stored in the database file so it only needs setting once
+            cursor.execute("PRAGMA journal_mode=WAL")
+            
+            # Databases created before timestamps were stored as integers
+            # are rebuilt with the ISO-8601 text converted to epoch microseconds
+            columns = self._table_columns(cursor)
+            migrate = columns.get('timestamp', '').upper() == 'TEXT'
+            if migrate:
+                cursor.execute("BEGIN")
+                cursor.execute("ALTER TABLE messages RENAME TO messages_old")
+            
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS messages (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
                     client_ip TEXT NOT NULL,
                     client_port INTEGER NOT NULL,
                     data BLOB NOT NULL,
-                    data_text TEXT,
                     data_size INTEGER NOT NULL
                 )
             """)
+            
+            if migrate:
+                cursor.execute("""
+                    INSERT INTO messages
+                    (id, timestamp, client_ip, client_port, data, data_size)
+                    SELECT
+                        id,
+                        CAST(strftime('%s', timestamp) AS INTEGER) * 1000000
+                            + CAST(substr(timestamp || '.000000', 21, 6) AS INTEGER),
+                        client_ip, client_port, data, data_size
+                    FROM messages_old
+                """)
+                cursor.execute("DROP TABLE messages_old")
+            elif 'data_text' in columns and sqlite3.sqlite_version_info >= (3, 35, 0):
+                # Payload text is decoded on read; drop the redundant copy
+                cursor.execute("ALTER TABLE messages DROP COLUMN data_text")
+            
             cursor.execute("""
                 CREATE INDEX IF NOT EXISTS idx_timestamp 
                 ON messages(timestamp DESC)
             """)
+            # Filtered queries read newest-first straight off this index and
+            # stop after LIMIT rows instead of sorting every match. It also
+            # covers lookups by IP alone, so the older (ip, port) index is dropped.
             cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_client 
-                ON messages(client_ip, client_port)
+                CREATE INDEX IF NOT EXISTS idx_ip_port_ts
+                ON messages(client_ip, client_port, timestamp DESC)
+            """)
+            cursor.execute("DROP INDEX IF EXISTS idx_client")
+            
+            # Row count kept up to date by triggers, so counting is a single
+            # lookup instead of a scan of the whole table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS _meta (
+                    k TEXT PRIMARY KEY,
+                    v INTEGER NOT NULL
+                )
+            """)
+            cursor.execute("""
+                INSERT OR IGNORE INTO _meta (k, v)
+                VALUES ('count', (SELECT COUNT(*) FROM messages))
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS messages_count_insert
+                AFTER INSERT ON messages
+                BEGIN
+                    UPDATE _meta SET v = v + 1 WHERE k = 'count';
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS messages_count_delete
+                AFTER DELETE ON messages
+                BEGIN
+                    UPDATE _meta SET v = v - 1 WHERE k = 'count';
+                END
             """)
             conn.commit()
-            conn.close()
+    
+    @staticmethod
+    def _table_columns(cursor: sqlite3.Cursor) -> Dict[str, str]:
+        """Get the column names and declared types of an existing messages table."""
+        cursor.execute("PRAGMA table_info(messages)")
+        return {column['name']: column['type'] for column in cursor.fetchall()}
+    
+    def _build_row(self, client_ip: str, client_port: int, data: bytes) -> Tuple:
+        """Build the INSERT parameters for a message received now."""
+        # Microseconds since the epoch; converted to ISO-8601 only when read.
+        # time_ns() avoids the float multiply and its rounding.
+        timestamp = time.time_ns() // 1000
+        return (timestamp, client_ip, client_port, data, len(data))
     
     def store_message(self, client_ip: str, client_port: int, data: bytes) -> int:
         """
@@ -63,29 +240,150 @@ class MessageStorage:
         Returns:
             The ID of the stored message
         """
-        timestamp = datetime.utcnow().isoformat()
-        data_size = len(data)
-        
-        # Try to decode as text for easier querying
-        try:
-            data_text = data.decode('utf-8')
-        except UnicodeDecodeError:
-            data_text = None
+        row = self._build_row(client_ip, client_port, data)
         
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._conn()
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO messages 
-                (timestamp, client_ip, client_port, data, data_text, data_size)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (timestamp, client_ip, client_port, data, data_text, data_size))
+                (timestamp, client_ip, client_port, data, data_size)
+                VALUES (?, ?, ?, ?, ?)
+            """, row)
             message_id = cursor.lastrowid
             conn.commit()
-            conn.close()
         
+        self._notify_stored()
         return message_id
     
+    def enqueue_message(self, client_ip: str, client_port: int, data: bytes) -> bool:
+        """
+        Queue a UDP message for the background writer without blocking.
+        
+        The message is written by a writer thread in batched transactions,
+        so the caller never waits on the database. If the queue is full the
+        message is dropped and counted in dropped_count.
+        
+        Args:
+            client_ip: IP address of the client
+            client_port: Port of the client
+            data: The message data as bytes
+            
+        Returns:
+            True if the message was queued, False if it was dropped
+        """
+        if self._writer_thread is None:
+            self.start_writer()
+        
+        try:
+            self.ingest_q.put_nowait(self._build_row(client_ip, client_port, data))
+        except queue.Full:
+            self.dropped_count += 1
+            return False
+        return True
+    
+    def flush(self):
+        """Block until every queued message has been written."""
+        self.ingest_q.join()
+    
+    def wait_for_count(self, count: int, timeout: Optional[float] = None) -> bool:
+        """
+        Block until at least count messages are stored.
+        
+        Woken by each commit rather than polling, so it returns as soon as
+        the message that reaches count is written.
+        
+        Args:
+            count: Number of stored messages to wait for
+            timeout: Maximum time to wait in seconds (default: None, no limit)
+            
+        Returns:
+            True if the count was reached, False on timeout
+        """
+        with self.stored:
+            return self.stored.wait_for(lambda: self.get_message_count() >= count, timeout)
+    
+    def _notify_stored(self):
+        """Wake threads waiting in wait_for_count()."""
+        with self.stored:
+            self.stored.notify_all()
+    
+    def close(self):
+        """
+        Write any queued messages, stop the background writer and close
+        the calling thread's connection.
+        """
+        with self._writer_start_lock:
+            thread = self._writer_thread
+            self._writer_thread = None
+        if thread is not None:
+            self.ingest_q.put(None)
+            thread.join()
+        
+        self._close_conn()
+    
+    def start_writer(self):
+        """
+        Start the background writer thread if it is not running.
+        
+        enqueue_message() starts it on first use, but the thread inherits
+        the CPU affinity and niceness of whichever thread starts it. Callers
+        that tune their own thread (like a pinned UDPListener) start the
+        writer beforehand so it keeps the process defaults.
+        """
+        with self._writer_start_lock:
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(target=self._writer, daemon=True)
+                self._writer_thread.start()
+    
+    def _writer(self):
+        """Drain the ingest queue, writing up to WRITE_BATCH_SIZE messages per transaction."""
+        stopping = False
+        while not stopping:
+            item = self.ingest_q.get()
+            if item is None:
+                self.ingest_q.task_done()
+                break
+            
+            batch = [item]
+            deadline = time.monotonic() + WRITE_BATCH_TIMEOUT
+            while len(batch) < WRITE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.ingest_q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"Error writing {len(batch)} messages: {e}", exc_info=True)
+            finally:
+                for _ in range(len(batch) + stopping):
+                    self.ingest_q.task_done()
+        
+        self._close_conn()
+    
+    def _write_batch(self, batch: List[Tuple]):
+        """Insert a batch of message rows in a single transaction."""
+        with self.lock:
+            conn = self._conn()
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO messages 
+                (timestamp, client_ip, client_port, data, data_size)
+                VALUES (?, ?, ?, ?, ?)
+            """, batch)
+            conn.commit()
+        
+        self._notify_stored()
+    
     def get_messages(
         self, 
         limit: Optional[int] = None,
@@ -105,80 +403,69 @@ class MessageStorage:
         Returns:
             List of message dictionaries
         """
-        query = "SELECT id, timestamp, client_ip, client_port, data, data_text, data_size FROM messages"
-        params = []
-        conditions = []
-        
-        if client_ip:
-            conditions.append("client_ip = ?")
-            params.append(client_ip)
-        
-        if client_port:
-            conditions.append("client_port = ?")
-            params.append(client_port)
-        
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
+        # SQLite treats a negative LIMIT as "no limit"
+        limit = -1 if limit is None else limit
+        offset = 0 if offset is None else offset
         
-        query += " ORDER BY timestamp DESC"
+        if client_ip is not None and client_port is not None:
+            params = (client_ip, client_port, limit, offset)
+        elif client_ip is not None:
+            params = (client_ip, limit, offset)
+        elif client_port is not None:
+            params = (client_port, limit, offset)
+        else:
+            params = (limit, offset)
+        query = _SELECT_MESSAGES[(client_ip is not None, client_port is not None)]
         
-        if limit:
-            query += " LIMIT ?"
-            params.append(limit)
+        # Reads need no lock: WAL readers see a consistent snapshot
+        cursor = self._conn().cursor()
+        cursor.execute(query, params)
         
-        if offset:
-            query += " OFFSET ?"
-            params.append(offset)
-        
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            conn.close()
+        # Build dicts straight from the cursor instead of materializing all rows first
+        return [self._row_to_dict(row) for row in cursor]
+    
+    def get_message_by_id(self, message_id: int) -> Optional[Dict]:
+        """
+        Retrieve a single stored message.
         
-        messages = []
-        for row in rows:
-            # Try to decode data as text, fallback to base64 for binary
-            data = row['data']
-            try:
-                if row['data_text']:
-                    data_repr = row['data_text']
-                else:
-                    data_repr = data.hex()
-            except:
-                data_repr = data.hex()
+        Args:
+            message_id: ID of the message
             
-            messages.append({
-                'id': row['id'],
-                'timestamp': row['timestamp'],
-                'client_ip': row['client_ip'],
-                'client_port': row['client_port'],
-                'data': data_repr,
-                'data_size': row['data_size']
-            })
-        
-        return messages
+        Returns:
+            Message dictionary, or None if no message has that ID
+        """
+        row = self._conn().execute(
+            "SELECT id, timestamp, client_ip, client_port, data, data_size FROM messages WHERE id = ?",
+            (message_id,)
+        ).fetchone()
+        return self._row_to_dict(row) if row is not None else None
+    
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict:
+        """Convert a messages row to the dictionary returned by the public getters."""
+        return {
+            'id': row['id'],
+            'timestamp': format_timestamp(row['timestamp']),
+            'client_ip': row['client_ip'],
+            'client_port': row['client_port'],
+            # Invalid UTF-8 (binary payloads) becomes U+FFFD
+            'data': row['data'].decode('utf-8', errors='replace'),
+            'data_size': row['data_size']
+        }
     
     def get_message_count(self) -> int:
         """Get the total number of stored messages."""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM messages")
-            count = cursor.fetchone()[0]
-            conn.close()
-        return count
+        cursor = self._conn().cursor()
+        cursor.execute("SELECT v FROM _meta WHERE k = 'count'")
+        return cursor.fetchone()[0]
     
     def clear_messages(self):
         """Clear all stored messages."""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._conn()
             cursor = conn.cursor()
             cursor.execute("DELETE FROM messages")
             conn.commit()
-            conn.close()
     
     def delete_old_messages(self, days: float = 1.0) -> int:
         """
@@ -190,19 +477,35 @@ class MessageStorage:
         Returns:
             Number of messages deleted
         """
-        cutoff_time = datetime.utcnow() - timedelta(days=days)
-        cutoff_timestamp = cutoff_time.isoformat()
+        cutoff_timestamp = time.time_ns() // 1000 - int(days * 86400 * 1_000_000)
         
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            # Count messages to be deleted
-            cursor.execute("SELECT COUNT(*) FROM messages WHERE timestamp < ?", (cutoff_timestamp,))
-            count = cursor.fetchone()[0]
-            # Delete old messages
-            cursor.execute("DELETE FROM messages WHERE timestamp < ?", (cutoff_timestamp,))
-            conn.commit()
-            conn.close()
+        # Delete in bounded batches, committing between them so the writer
+        # lock is never held for a whole-table scan
+        deleted = 0
+        while True:
+            with self.lock:
+                conn = self._conn()
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM messages WHERE id IN (
+                        SELECT id FROM messages
+                        WHERE timestamp < ?
+                        ORDER BY timestamp
+                        LIMIT ?
+                    )
+                """, (cutoff_timestamp, DELETE_BATCH_SIZE))
+                conn.commit()
+            
+            deleted += cursor.rowcount
+            if cursor.rowcount < DELETE_BATCH_SIZE:
+                break
         
-        return count
-
+        if deleted:
+            # Return some of the freed pages to the OS without rewriting the
+            # whole file; a no-op unless auto_vacuum is INCREMENTAL
+            with self.lock:
+                conn = self._conn()
+                conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+                conn.commit()
+        
+        return deleted
@@ -3,11 +3,56 @@ UDP Listener that receives datagrams, echoes them back with "ECHO:" prefix,
 and stores them in the database.
 """
 
+import logging
+import os
+import selectors
 import socket
+import sys
 import threading
-from typing import Optional
+import time
+from typing import List, Optional, Tuple
+from . import mmsg
 from .storage import MessageStorage
 
+logger = logging.getLogger(__name__)
+
+
+# Prefix prepended to every echoed datagram
+ECHO_PREFIX = b"ECHO:"
+
+# Default SO_RCVBUF/SO_SNDBUF size, large enough to absorb bursts
+DEFAULT_SOCKET_BUFFER = 8 * 1024 * 1024
+
+# Upper bound (seconds) on how long the receive loop waits between checks
+# for stop(); normally stop() wakes it immediately
+SELECT_TIMEOUT = 0.5
+
+# socket.sendmsg() is not available on every platform (e.g. Windows)
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+# Niceness adjustment applied to the receive thread (needs CAP_SYS_NICE)
+LISTENER_NICE = -5
+
+# Minimum interval (seconds) between repeats of the same receive-loop warning
+WARNING_INTERVAL = 10.0
+
+
+def exclude_cpu(cpu: Optional[int]):
+    """
+    Remove a CPU from the calling thread's affinity mask.
+    
+    Threads started afterwards inherit the mask, so calling this before
+    starting the REST API keeps its threads off the listener's core.
+    
+    Args:
+        cpu: CPU reserved for the UDP listener, or None to do nothing
+    """
+    if cpu is None or not hasattr(os, 'sched_setaffinity'):
+        return
+    cpus = os.sched_getaffinity(0) - {cpu}
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
 
 class UDPListener:
     """UDP listener that echoes messages and stores them."""
@@ -16,7 +61,10 @@ class UDPListener:
         self, 
         host: str = '0.0.0.0',
         port: int = 8888,
-        storage: Optional[MessageStorage] = None
+        storage: Optional[MessageStorage] = None,
+        rcvbuf: int = DEFAULT_SOCKET_BUFFER,
+        sndbuf: int = DEFAULT_SOCKET_BUFFER,
+        cpu: Optional[int] = None
     ):
         """
         Initialize the UDP listener.
@@ -25,83 +73,270 @@ class UDPListener:
             host: Host to bind to (default: 0.0.0.0 for all interfaces)
             port: Port to listen on
             storage: MessageStorage instance for storing messages
+            rcvbuf: Socket receive buffer size in bytes (default: 8 MiB)
+            sndbuf: Socket send buffer size in bytes (default: 8 MiB)
+            cpu: CPU to pin the receive thread to (default: None, no pinning)
         """
         self.host = host
         self.port = port
+        # Storage created here is also closed here, by stop()
+        self._owns_storage = storage is None
         self.storage = storage or MessageStorage()
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.cpu = cpu
         self.sock = None
+        # Written to by stop() to wake the receive loop out of select()
+        self._wake_r = None
+        self._wake_w = None
         self.running = False
         self.thread = None
+        self.received_count = 0
+        # monotonic() time each rate-limited warning was last logged
+        self._warned_at = {}
+        # Set once the socket is bound and datagrams can be received
+        self.ready = threading.Event()
     
     def start(self):
         """Start the UDP listener in a separate thread."""
         if self.running:
             return
         
+        # Started from this thread so the writer does not inherit the
+        # receive thread's CPU pinning and raised priority
+        self.storage.start_writer()
+        
         self.running = True
+        self.ready.clear()
         self.thread = threading.Thread(target=self._run, daemon=True)
         self.thread.start()
         print(f"UDP Listener started on {self.host}:{self.port}")
     
     def stop(self):
-        """Stop the UDP listener."""
+        """Stop the UDP listener and wait until every received message is stored."""
         self.running = False
-        if self.sock:
-            self.sock.close()
+        # Wake the receive loop, which then closes the socket itself
+        if self._wake_w is not None:
+            try:
+                self._wake_w.send(b'\0')
+            except OSError:
+                pass
         if self.thread:
             self.thread.join(timeout=2)
+        if self.sock:
+            self.sock.close()
+        # Write out messages still queued for the storage writer
+        if self._owns_storage:
+            self.storage.close()
+        else:
+            self.storage.flush()
         print("UDP Listener stopped")
     
     def _run(self):
         """Main loop for receiving and processing UDP messages."""
+        self._pin_thread()
+        selector = selectors.DefaultSelector()
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._set_buffer_size(socket.SO_RCVBUF, self.rcvbuf, "receive")
+            self._set_buffer_size(socket.SO_SNDBUF, self.sndbuf, "send")
             self.sock.bind((self.host, self.port))
+            self.sock.setblocking(False)
+            selector.register(self.sock, selectors.EVENT_READ, data=True)
+            self._wake_r, self._wake_w = socket.socketpair()
+            selector.register(self._wake_r, selectors.EVENT_READ, data=False)
+            self.ready.set()
             
             print(f"UDP Listener listening on {self.host}:{self.port}")
             
+            # Reuse one set of recvmmsg()/sendmmsg() buffers for the lifetime of the socket
+            if mmsg.AVAILABLE:
+                batch = mmsg.RecvBatch()
+                echo_batch = mmsg.EchoBatch(batch, ECHO_PREFIX)
+            else:
+                batch = echo_batch = None
+            
             while self.running:
                 try:
-                    # Receive datagram
-                    data, addr = self.sock.recvfrom(4096)
-                    client_ip, client_port = addr
-                    
-                    # Store the message
-                    message_id = self.storage.store_message(
-                        client_ip=client_ip,
-                        client_port=client_port,
-                        data=data
-                    )
-                    
-                    # Prepare echo response with "ECHO:" prefix
-                    echo_prefix = b"ECHO:"
-                    echo_response = echo_prefix + data
-                    
-                    # Send echo response
-                    self.sock.sendto(echo_response, addr)
-                    
-                    # Log the activity
-                    try:
-                        data_preview = data.decode('utf-8')[:50]
-                        if len(data) > 50:
-                            data_preview += "..."
-                    except UnicodeDecodeError:
-                        data_preview = f"<binary: {len(data)} bytes>"
-                    
-                    print(f"[{message_id}] Received from {client_ip}:{client_port}: {data_preview}")
-                    print(f"[{message_id}] Echoed back with ECHO: prefix")
-                    
+                    # Wait for readability, then drain everything already queued.
+                    # A wake-up from stop() just lets the loop condition be rechecked.
+                    if any(key.data for key, _ in selector.select(timeout=SELECT_TIMEOUT)):
+                        self._drain(batch, echo_batch)
                 except socket.error as e:
                     if self.running:
                         print(f"Socket error: {e}")
                     break
-                except Exception as e:
-                    print(f"Error processing message: {e}")
         
         except Exception as e:
             print(f"UDP Listener error: {e}")
         finally:
+            selector.close()
             if self.sock:
                 self.sock.close()
-
+            for wake_sock in (self._wake_r, self._wake_w):
+                if wake_sock is not None:
+                    wake_sock.close()
+    
+    def _pin_thread(self):
+        """Pin the receive thread to its CPU and raise its priority, where permitted."""
+        if self.cpu is None or not hasattr(os, 'sched_setaffinity'):
+            return
+        
+        # On Linux both calls apply to the calling thread only
+        try:
+            os.sched_setaffinity(0, {self.cpu})
+        except OSError as e:
+            print(f"UDP Listener could not pin to CPU {self.cpu}: {e}")
+            return
+        
+        try:
+            os.nice(LISTENER_NICE)
+        except OSError:
+            # Unprivileged processes may not lower their niceness
+            pass
+    
+    def _drain(self, batch: Optional[mmsg.RecvBatch], echo_batch: Optional[mmsg.EchoBatch]):
+        """
+        Receive, store and echo datagrams until the socket has none left.
+        
+        Only datagrams accepted for storage are echoed, so an echo tells the
+        sender its message was queued to be written.
+        
+        Args:
+            batch: Preallocated recvmmsg() batch, or None to fall back to recvfrom()
+            echo_batch: sendmmsg() batch matching the receive batch, or None
+        """
+        while self.running:
+            try:
+                # Receive as many pending datagrams as possible in one syscall
+                packets = self._receive(batch)
+            except BlockingIOError:
+                return
+            
+            rejected = None
+            queue_full = False
+            for i, (data, addr) in enumerate(packets):
+                try:
+                    if self._store(data, addr):
+                        continue
+                    queue_full = True
+                except Exception as e:
+                    print(f"Error processing message: {e}")
+                if rejected is None:
+                    rejected = set()
+                rejected.add(i)
+            
+            batch_echo = echo_batch
+            if rejected is not None:
+                # Rare: echo this batch's accepted datagrams one by one; later
+                # batches still use sendmmsg()
+                packets = [packet for i, packet in enumerate(packets) if i not in rejected]
+                batch_echo = None
+            if queue_full:
+                self._warn_rate_limited(
+                    'dropped', "Storage queue full: %d message(s) dropped so far", self.storage.dropped_count
+                )
+            
+            try:
+                self._echo(packets, batch_echo)
+            except BlockingIOError:
+                # Send buffer full: echoes are best effort, so they are dropped
+                logger.debug("Send buffer full, echoes dropped")
+            except socket.error as e:
+                self._warn_rate_limited('echo', "Error sending echo: %s", e)
+    
+    def _warn_rate_limited(self, key: str, message: str, *args):
+        """
+        Log a receive-loop warning at most once per WARNING_INTERVAL.
+        
+        Args:
+            key: Identifies the warning for rate limiting
+            message: Logging format string
+            args: Arguments for message
+        """
+        now = time.monotonic()
+        if now - self._warned_at.get(key, float('-inf')) >= WARNING_INTERVAL:
+            self._warned_at[key] = now
+            logger.warning(message, *args)
+    
+    def _set_buffer_size(self, option: int, size: int, name: str):
+        """
+        Set a socket buffer size, warning if the kernel caps it.
+        
+        Args:
+            option: SO_RCVBUF or SO_SNDBUF
+            size: Requested buffer size in bytes
+            name: Buffer name used in the warning
+        """
+        self.sock.setsockopt(socket.SOL_SOCKET, option, size)
+        # Linux caps the value at net.core.rmem_max / net.core.wmem_max, then
+        # doubles it for bookkeeping and reports the doubled value
+        actual = self.sock.getsockopt(socket.SOL_SOCKET, option)
+        if sys.platform.startswith('linux'):
+            actual //= 2
+        if actual < size:
+            print(f"UDP Listener {name} buffer capped at {actual} bytes (requested {size}); "
+                  f"raise net.core.{'rmem' if option == socket.SO_RCVBUF else 'wmem'}_max to allow more")
+    
+    def _receive(self, batch: Optional[mmsg.RecvBatch]) -> List[Tuple[bytes, Tuple[str, int]]]:
+        """
+        Receive the next datagrams from the socket.
+        
+        Args:
+            batch: Preallocated recvmmsg() batch, or None to fall back to recvfrom()
+            
+        Returns:
+            List of (data, (client_ip, client_port)) tuples
+        """
+        if batch is None:
+            return [self.sock.recvfrom(mmsg.BUFFER_SIZE)]
+        count = batch.recv(self.sock)
+        return batch.packets(count)
+    
+    def _store(self, data: bytes, addr: Tuple[str, int]) -> bool:
+        """
+        Queue a received datagram for storage.
+        
+        Returns:
+            True if the datagram was queued, False if the queue was full
+        """
+        client_ip, client_port = addr
+        self.received_count += 1
+        
+        # Hand the message to the storage writer thread; never block on the database
+        if not self.storage.enqueue_message(
+            client_ip=client_ip,
+            client_port=client_port,
+            data=data
+        ):
+            logger.debug("[%d] Storage queue full, dropped %s:%d", self.received_count, client_ip, client_port)
+            return False
+        
+        # Lazy %-formatting: nothing is formatted unless DEBUG is enabled
+        logger.debug("[%d] %s:%d %d bytes", self.received_count, client_ip, client_port, len(data))
+        return True
+    
+    def _echo(
+        self,
+        packets: List[Tuple[bytes, Tuple[str, int]]],
+        echo_batch: Optional[mmsg.EchoBatch]
+    ):
+        """
+        Echo received datagrams back to their senders with the "ECHO:" prefix.
+        
+        Args:
+            packets: Datagrams returned by the last _receive() call
+            echo_batch: sendmmsg() batch matching the receive batch, or None to fall back to sendto()
+        """
+        if echo_batch is not None:
+            echo_batch.send(self.sock, len(packets))
+        elif _HAS_SENDMSG:
+            for data, addr in packets:
+                # Scatter-send prefix and payload without concatenating them
+                self.sock.sendmsg([ECHO_PREFIX, data], [], 0, addr)
+        else:
+            for data, addr in packets:
+                self.sock.sendto(ECHO_PREFIX + data, addr)
+        
+        logger.debug("Echoed %d message(s)", len(packets))
@@ -2,14 +2,172 @@
 Simple module to fetch UDP messages from the udpmonitor database.
 """
 
+import atexit
+import itertools
+import logging
 import sqlite3
-from typing import List, Optional
-from dataclasses import dataclass
+import threading
+import weakref
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+from .storage import format_timestamp
 
+if TYPE_CHECKING:
+    # Optional "arrow" extra; imported at call time
+    import duckdb
+    import pyarrow
 
-@dataclass
-class Message:
-    """Message object with easy-to-access attributes."""
+logger = logging.getLogger(__name__)
+
+# Per-thread connections keyed by db_path, opened on first use
+_tls = threading.local()
+
+
+def _close_all(conns: Dict[str, sqlite3.Connection]):
+    """Close and forget every connection in one thread's pool."""
+    for conn in list(conns.values()):
+        conn.close()
+    conns.clear()
+
+
+class _Pool:
+    """One thread's connections keyed by db_path."""
+    __slots__ = ('conns', '__weakref__')
+    
+    def __init__(self):
+        self.conns: Dict[str, sqlite3.Connection] = {}
+        # Close the connections as soon as the owning thread exits and its
+        # thread-local pool is freed, rather than whenever the cycle
+        # collector gets to them
+        weakref.finalize(self, _close_all, self.conns)
+
+
+# Every live thread's pool, so all pooled connections can be closed. Held
+# weakly, so pools of exited threads are not kept alive.
+_pools: "weakref.WeakSet[_Pool]" = weakref.WeakSet()
+_pools_lock = threading.Lock()
+
+# Columns in Message field order, less the decoded text
+_SELECT_MESSAGES = "SELECT id, timestamp, client_ip, client_port, data, data_size FROM messages"
+
+# Columns for LazyMessage: everything except the payload
+_SELECT_METADATA = "SELECT id, timestamp, client_ip, client_port, data_size FROM messages"
+
+
+def _build_query(select: str, filter_ip: bool, filter_port: bool, limited: bool) -> str:
+    """Build the get_messages() query for one combination of columns, filters and limit."""
+    query = select
+    conditions = []
+    if filter_ip:
+        conditions.append("client_ip = ?")
+    if filter_port:
+        conditions.append("client_port = ?")
+    if conditions:
+        # Filtered queries read newest-first from idx_ip_port_ts
+        query += " WHERE " + " AND ".join(conditions) + " ORDER BY timestamp DESC"
+    else:
+        # ids are assigned in insert (receive) order, so walking the rowid
+        # B-tree backwards gives the same order without touching an index
+        query += " ORDER BY id DESC"
+    if limited:
+        query += " LIMIT ?"
+    return query
+
+
+# get_messages() queries keyed by (eager, filter by IP, filter by port, has
+# limit). Reusing the exact same SQL strings lets each connection's
+# statement cache skip re-preparing them.
+_QUERIES = {
+    (eager, filter_ip, filter_port, limited): _build_query(
+        _SELECT_MESSAGES if eager else _SELECT_METADATA, filter_ip, filter_port, limited
+    )
+    for eager in (False, True)
+    for filter_ip in (False, True)
+    for filter_port in (False, True)
+    for limited in (False, True)
+}
+
+
+# Maximum number of queries whose latest result is kept by _fetch_cached()
+CACHE_SIZE = 32
+
+# Largest limit whose results are cached; bigger reads always run the query
+CACHE_MAX_ROWS = 200
+
+# (db_path, connection generation, query, params) -> (data_version, messages)
+_cache: Dict[Tuple, Tuple[int, Tuple["Message", ...]]] = {}
+_cache_lock = threading.Lock()
+
+# Source of process-unique connection generation numbers
+_generations = itertools.count()
+
+
+class _Connection(sqlite3.Connection):
+    """Pooled connection tagged with a generation number, for cache keys."""
+    generation: int
+
+
+def _get_conn(db_path: str) -> _Connection:
+    """
+    Get the calling thread's cached connection to a database.
+    
+    Opening a connection costs a file open, WAL index mapping and schema
+    read, which dominates small queries, so each thread keeps one
+    connection per database for reuse.
+    
+    Args:
+        db_path: Path to SQLite database file, or a "file:" URI
+        
+    Returns:
+        Open read-only connection returning tuple rows
+    """
+    pool = getattr(_tls, 'pool', None)
+    if pool is None:
+        pool = _tls.pool = _Pool()
+        with _pools_lock:
+            _pools.add(pool)
+    conns = pool.conns
+    
+    conn = conns.get(db_path)
+    if conn is None:
+        # udpfetch only reads: open read-only so SQLite never takes write
+        # locks on our behalf. A read-only connection cannot checkpoint or
+        # delete the -wal/-shm files, so they stay behind if it closes last.
+        # URIs (e.g. "file:...?mode=memory") are used as given.
+        uri = db_path if db_path.startswith('file:') else Path(db_path).absolute().as_uri() + '?mode=ro'
+        # Plain tuple rows: unpacking them positionally is cheaper than
+        # sqlite3.Row name lookups
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=128,
+                               factory=_Connection)
+        # Unlike id(conn), never reused after the connection is closed
+        conn.generation = next(_generations)
+        conn.execute("PRAGMA query_only=1")
+        # Serve pages straight from a memory map instead of read() calls
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        conns[db_path] = conn
+    return conn
+
+
+@atexit.register
+def close_connections():
+    """Close every cached connection, in all threads; they reopen on next use."""
+    with _pools_lock:
+        for pool in list(_pools):
+            _close_all(pool.conns)
+    # Entries for closed connections can never be hit again
+    with _cache_lock:
+        _cache.clear()
+
+
+class Message(NamedTuple):
+    """
+    Message object with easy-to-access attributes.
+    
+    A NamedTuple: immutable, no per-instance __dict__, and built from a row
+    tuple in one C-level call with Message._make().
+    """
     id: int
     timestamp: str
     ip: str
@@ -19,15 +177,111 @@ class Message:
     data_size: int
     
     def __repr__(self):
-        return f"Message(id={self.id}, ip={self.ip}, port={self.port}, message={self.message[:50] if len(self.message) > 50 else self.message}...)"
+        # Slicing is already safe for short strings
+        return f"Message(id={self.id}, ip={self.ip}, port={self.port}, message={self.message[:50]}...)"
+    
+    __str__ = __repr__
+
+
+def _load_data(db_path: str, message_id: int) -> bytes:
+    """
+    Read one message payload.
+    
+    Uses incremental BLOB I/O where available (Python 3.11+), which reads
+    the value without preparing a SELECT.
+    
+    Raises:
+        LookupError: If the message no longer exists
+    """
+    conn = _get_conn(db_path)
+    if hasattr(conn, 'blobopen'):
+        try:
+            with conn.blobopen('messages', 'data', message_id, readonly=True) as blob:
+                return blob.read()
+        except sqlite3.OperationalError:
+            # No such row; the SELECT below reports it
+            pass
+    
+    row = conn.execute("SELECT data FROM messages WHERE id = ?", (message_id,)).fetchone()
+    if row is None:
+        raise LookupError(f"Message {message_id} no longer exists")
+    return row[0]
+
+
+class LazyMessage:
+    """
+    Message whose payload is read from the database on first access.
+    
+    Has the same attributes as Message. data and message (the decoded text)
+    are loaded together the first time either is used, from the thread's
+    pooled connection.
+    """
+    __slots__ = ('id', 'timestamp', 'ip', 'port', 'data_size', '_db_path', '_data', '_message')
+    
+    def __init__(self, id: int, timestamp: str, ip: str, port: int, data_size: int, db_path: str):
+        self.id = id
+        self.timestamp = timestamp
+        self.ip = ip
+        self.port = port
+        self.data_size = data_size
+        self._db_path = db_path
+        self._data = None
+        self._message = None
+    
+    @property
+    def data(self) -> bytes:
+        """Raw payload, loaded on first access."""
+        if self._data is None:
+            self._data = _load_data(self._db_path, self.id)
+        return self._data
+    
+    @property
+    def message(self) -> str:
+        """Payload decoded as text (invalid UTF-8 becomes U+FFFD), loaded on first access."""
+        if self._message is None:
+            data = self.data
+            self._message = data.decode() if data.isascii() else data.decode('utf-8', 'replace')
+        return self._message
+    
+    def __repr__(self):
+        # Never touches the database: repr() runs in logging and debuggers,
+        # where a query (or a purged row) must not fail
+        message = '<not loaded>' if self._message is None else f"{self._message[:50]}..."
+        return f"LazyMessage(id={self.id}, ip={self.ip}, port={self.port}, message={message})"
+    
+    __str__ = __repr__
+
+
+def _build_messages_py(rows: Iterable[Tuple], make: Callable) -> List[Message]:
+    """
+    Build Messages from (id, timestamp, client_ip, client_port, data, data_size) rows.
+    
+    Pure-Python twin of _udpfetch_c.build_messages, which also formats the
+    timestamps in C; used when the compiled extension is not available.
+    """
+    # ASCII payloads (the common case) take the cheapest decode call;
+    # anything else is decoded with invalid UTF-8 becoming U+FFFD
+    return [
+        make((id_, format_timestamp(timestamp), ip, port,
+              data.decode() if data.isascii() else data.decode('utf-8', 'replace'),
+              data, data_size))
+        for id_, timestamp, ip, port, data, data_size in rows
+    ]
+
+
+try:
+    from ._udpfetch_c import build_messages as _build_messages
+except ImportError:
+    _build_messages = _build_messages_py
 
 
 def get_messages(
     limit: Optional[int] = None,
     db_path: str = "udpmonitor.db",
     client_ip: Optional[str] = None,
-    client_port: Optional[int] = None
-) -> List[Message]:
+    client_port: Optional[int] = None,
+    eager: bool = True
+) -> List[Union[Message, LazyMessage]]:
     """
     Retrieve messages from the udpmonitor database.
     
@@ -36,9 +290,13 @@ def get_messages(
         db_path: Path to SQLite database file (default: udpmonitor.db)
         client_ip: Filter by client IP address (optional)
         client_port: Filter by client port (optional)
+        eager: Load payloads with the query (default: True). With False,
+            LazyMessage objects are returned that read data/message only
+            when accessed, for callers that mostly need the metadata.
     
     Returns:
-        List of Message objects with attributes: id, timestamp, ip, port, message, data, data_size
+        List of Message objects with attributes: id, timestamp, ip, port, message, data, data_size,
+        newest (most recently received) first
     
     Example:
         >>> from udpmonitor import udpfetch
@@ -50,56 +308,171 @@ def get_messages(
         >>> print(messages[0].message)
         'Hello, World!'
     """
-    query = "SELECT id, timestamp, client_ip, client_port, data, data_text, data_size FROM messages"
-    params = []
-    conditions = []
+    query = _QUERIES[(eager, client_ip is not None, client_port is not None, limit is not None)]
+    if client_ip is None and client_port is None:
+        # Common unfiltered case: no parameters to collect
+        params = () if limit is None else (limit,)
+    else:
+        params = tuple(value for value in (client_ip, client_port, limit) if value is not None)
     
-    if client_ip:
-        conditions.append("client_ip = ?")
-        params.append(client_ip)
-    
-    if client_port:
-        conditions.append("client_port = ?")
-        params.append(client_port)
+    conn = _get_conn(db_path)
+    if eager and limit is not None and limit <= CACHE_MAX_ROWS:
+        # Dashboards re-poll the same small bounded query; answer from the
+        # cache until the database has changed
+        return list(_fetch_cached(conn, db_path, query, params))
     
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
     
-    query += " ORDER BY timestamp DESC"
+    try:
+        # Stream rows from the cursor rather than materializing them all first
+        if eager:
+            return _build_messages(cursor, Message._make)
+        return [
+            LazyMessage(id_, format_timestamp(timestamp), ip, port, data_size, db_path)
+            for id_, timestamp, ip, port, data_size in cursor
+        ]
+    finally:
+        cursor.close()
+
+
+def _fetch_cached(conn: _Connection, db_path: str, query: str, params: Tuple) -> Tuple[Message, ...]:
+    """
+    Run an eager get_messages() query, reusing the last result while the
+    database is unchanged.
     
-    if limit:
-        query += " LIMIT ?"
-        params.append(limit)
+    data_version changes whenever another connection commits and is free to
+    check, but its values are only comparable on one connection, so the
+    connection's generation is part of the key. Each key keeps just its
+    latest result: under steady ingest every poll sees a new version, and
+    results for older versions could never be hit again. Results are
+    returned as a tuple so a cached entry cannot be modified by a caller.
+    """
+    key = (db_path, conn.generation, query, params)
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry is not None and entry[0] == data_version:
+        return entry[1]
     
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-    
-    messages = []
-    for row in rows:
-        # Use data_text if available, otherwise decode data or use hex representation
-        if row['data_text']:
-            message_text = row['data_text']
-        else:
-            try:
-                message_text = row['data'].decode('utf-8', errors='replace')
-            except:
-                message_text = row['data'].hex()
-        
-        messages.append(Message(
-            id=row['id'],
-            timestamp=row['timestamp'],
-            ip=row['client_ip'],
-            port=row['client_port'],
-            message=message_text,
-            data=row['data'],
-            data_size=row['data_size']
-        ))
+    try:
+        result = tuple(_build_messages(cursor, Message._make))
+    finally:
+        cursor.close()
+    
+    with _cache_lock:
+        # Re-inserting moves the key to the end, so the oldest-polled
+        # query is the one evicted
+        _cache.pop(key, None)
+        if len(_cache) >= CACHE_SIZE:
+            del _cache[next(iter(_cache))]
+        _cache[key] = (data_version, result)
+    return result
+
+
+# Set once DuckDB's sqlite extension has failed to load
+_duckdb_failed = False
+
+# Smallest limit read through DuckDB by get_messages_arrow()
+ARROW_DUCKDB_MIN_LIMIT = 10000
+
+# get_messages_arrow() columns, read by DuckDB straight from the SQLite file
+_SELECT_ARROW = (
+    "SELECT id, make_timestamp(timestamp) AS timestamp, client_ip, client_port, data, data_size "
+    "FROM sqlite_scan(?, 'messages')"
+)
+
+
+def _duckdb_connect() -> Optional["duckdb.DuckDBPyConnection"]:
+    """
+    Open a DuckDB connection with the sqlite extension loaded.
+    
+    Returns:
+        The connection, or None if duckdb is not installed or the extension
+        is unavailable (e.g. it cannot be downloaded). An extension failure
+        is remembered so later calls don't retry, and wait on the network,
+        every time.
+    """
+    global _duckdb_failed
+    if _duckdb_failed:
+        return None
+    try:
+        import duckdb
+    except ImportError:
+        return None
     
-    return messages
+    conn = duckdb.connect()
+    try:
+        conn.execute("INSTALL sqlite; LOAD sqlite")
+    except duckdb.Error as e:
+        conn.close()
+        logger.warning("DuckDB sqlite extension unavailable, using sqlite3: %s", e)
+        _duckdb_failed = True
+        return None
+    return conn
+
+
+def get_messages_arrow(
+    limit: Optional[int] = None,
+    db_path: str = "udpmonitor.db",
+    client_ip: Optional[str] = None,
+    client_port: Optional[int] = None
+) -> "pyarrow.Table":
+    """
+    Retrieve messages as a columnar Arrow table, for bulk analysis.
+    
+    Needs the optional "arrow" extra (pyarrow; duckdb is used when
+    available). For large reads (no limit, or one of at least
+    ARROW_DUCKDB_MIN_LIMIT) DuckDB reads the SQLite file directly through its
+    sqlite extension and no per-row Python objects are built; otherwise the
+    rows are fetched with sqlite3 and transposed into columns.
+    
+    Args:
+        limit: Maximum number of messages to return (default: None, returns all)
+        db_path: Path to SQLite database file (default: udpmonitor.db)
+        client_ip: Filter by client IP address (optional)
+        client_port: Filter by client port (optional)
+    
+    Returns:
+        pyarrow.Table with columns id, timestamp (UTC, microseconds), client_ip,
+        client_port, data and data_size, newest first
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("get_messages_arrow() requires pyarrow: pip install 'udpmonitor[arrow]'") from None
+    
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('timestamp', pa.timestamp('us')),
+        ('client_ip', pa.string()),
+        ('client_port', pa.int64()),
+        ('data', pa.binary()),
+        ('data_size', pa.int64()),
+    ])
+    params = tuple(value for value in (client_ip, client_port, limit) if value is not None)
+    
+    # sqlite_scan reads the whole table before filtering and sorting, so
+    # small bounded reads are faster through sqlite3 and the indexes
+    if not db_path.startswith('file:') and (limit is None or limit >= ARROW_DUCKDB_MIN_LIMIT):
+        conn = _duckdb_connect()
+        if conn is not None:
+            # Same WHERE/ORDER BY as get_messages(), so both backends return
+            # rows in the same order
+            query = _build_query(_SELECT_ARROW, client_ip is not None, client_port is not None, limit is not None)
+            with conn:
+                return conn.execute(query, (db_path,) + params).fetch_arrow_table().cast(schema)
+    
+    cursor = _get_conn(db_path).cursor()
+    cursor.execute(_QUERIES[(True, client_ip is not None, client_port is not None, limit is not None)], params)
+    try:
+        columns = list(zip(*cursor)) or [()] * len(schema)
+    finally:
+        cursor.close()
+    return pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                schema=schema)
 
 
 def get_message_count(db_path: str = "udpmonitor.db") -> int:
@@ -112,12 +485,18 @@ def get_message_count(db_path: str = "udpmonitor.db") -> int:
     Returns:
         Total count of messages
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM messages")
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    cursor = _get_conn(db_path).cursor()
+    try:
+        # Maintained by triggers on the messages table; see MessageStorage._init_db
+        cursor.execute("SELECT v FROM _meta WHERE k = 'count'")
+    except sqlite3.OperationalError:
+        # No _meta table: the database has not been opened by a current
+        # MessageStorage yet, and this read-only connection cannot add it
+        cursor.execute("SELECT COUNT(*) FROM messages")
+    try:
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
 
 
 def get_latest_message(db_path: str = "udpmonitor.db") -> Optional[Message]:
@@ -130,6 +509,18 @@ def get_latest_message(db_path: str = "udpmonitor.db") -> Optional[Message]:
     Returns:
         Most recent Message object, or None if no messages exist
     """
-    messages = get_messages(limit=1, db_path=db_path)
-    return messages[0] if messages else None
-
+    # id grows with every insert, so the newest message is the rightmost
+    # rowid; no sort or timestamp index needed
+    cursor = _get_conn(db_path).cursor()
+    cursor.execute(_SELECT_MESSAGES + " ORDER BY id DESC LIMIT 1")
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None:
+        return None
+    
+    id_, timestamp, ip, port, data, data_size = row
+    return Message._make((
+        id_, format_timestamp(timestamp), ip, port,
+        data.decode() if data.isascii() else data.decode('utf-8', 'replace'),
+        data, data_size
+    ))
@@ -6,6 +6,7 @@ import pytest
 import tempfile
 import os
 import sys
+import uuid
 from pathlib import Path
 
 # Add src directory to Python path for imports
@@ -14,31 +15,55 @@ src_path = project_root / "src"
 if str(src_path) not in sys.path:
     sys.path.insert(0, str(src_path))
 
-from udpmonitor import MessageStorage
+from udpmonitor import MessageStorage, udpfetch
 
 
 @pytest.fixture
 def temp_db():
-    """Create a temporary database for testing."""
-    fd, db_path = tempfile.mkstemp(suffix='.db')
-    os.close(fd)
+    """
+    Create a temporary in-memory database for testing.
+    
+    A shared-cache memory URI lets every connection in the process (storage
+    threads and udpfetch readers) see the same database with no file I/O.
+    It bypasses udpfetch's read-only WAL connection setup, so tests of
+    connections, caching and Arrow reads use file_db instead.
+    """
+    db_path = f"file:udpmon_{uuid.uuid4().hex}?mode=memory&cache=shared"
     
     storage = MessageStorage(db_path=db_path)
     
     yield storage, db_path
     
-    # Cleanup
-    if os.path.exists(db_path):
-        os.unlink(db_path)
+    # The database disappears once its last connection is closed
+    storage.close()
+    udpfetch.close_connections()
 
 
 @pytest.fixture
-def sample_messages(temp_db):
-    """Create sample messages in the database."""
-    import time
-    storage, db_path = temp_db
+def file_db():
+    """
+    Create a temporary on-disk database for testing.
+    
+    For tests that need a real file (WAL) or read while the background
+    writer is busy, which shared-cache memory databases report as locked.
+    """
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    
+    storage = MessageStorage(db_path=db_path)
+    
+    yield storage, db_path
     
-    # Add some test messages with small delays to ensure different timestamps
+    # Cleanup (including WAL side files)
+    storage.close()
+    udpfetch.close_connections()
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _store_samples(storage):
+    """Store the sample messages, returning them in insertion order."""
     messages = [
         ("192.168.1.100", 54321, b"Hello, World!"),
         ("192.168.1.101", 54322, b"Test message 1"),
@@ -46,9 +71,27 @@ def sample_messages(temp_db):
         ("10.0.0.1", 12345, b"Binary test: \x00\x01\x02\x03"),
     ]
     
-    for ip, port, data in messages:
-        storage.store_message(ip, port, data)
-        time.sleep(0.01)  # Small delay to ensure different timestamps
+    ids = [storage.store_message(ip, port, data) for ip, port, data in messages]
+    # Tests rely on insertion order, which the ids record
+    assert ids == sorted(ids)
     
-    return storage, db_path, messages
+    return messages
+
+
+@pytest.fixture
+def sample_messages(temp_db):
+    """Create sample messages in the database."""
+    storage, db_path = temp_db
+    return storage, db_path, _store_samples(storage)
 
+
+@pytest.fixture
+def sample_file_messages(file_db):
+    """
+    Create sample messages in an on-disk database.
+    
+    udpfetch opens plain paths read-only in WAL mode, unlike "file:"
+    URIs, so tests of that connection path use this fixture.
+    """
+    storage, db_path = file_db
+    return storage, db_path, _store_samples(storage)
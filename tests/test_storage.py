@@ -17,9 +17,34 @@ class TestMessageStorage:
         assert storage.db_path == db_path
         assert storage.lock is not None
         
-        # Verify database was created
-        import os
-        assert os.path.exists(db_path)
+        # Verify the schema was created
+        tables = {row['name'] for row in storage._conn().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert 'messages' in tables
+    
+    def test_wal_mode(self, file_db):
+        """Test the database is switched to WAL journaling."""
+        import sqlite3
+        _, db_path = file_db
+        
+        conn = sqlite3.connect(db_path)
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.close()
+        
+        assert journal_mode == "wal"
+    
+    def test_page_size_and_auto_vacuum(self, file_db):
+        """Test a new database uses large pages and incremental auto-vacuum."""
+        import sqlite3
+        from udpmonitor.storage import PAGE_SIZE
+        _, db_path = file_db
+        
+        conn = sqlite3.connect(db_path)
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        conn.close()
+        
+        assert page_size == PAGE_SIZE
+        assert auto_vacuum == 2  # INCREMENTAL
     
     def test_store_message(self, temp_db):
         """Test storing a message."""
@@ -160,3 +185,155 @@ class TestMessageStorage:
         assert len(messages) == 1
         assert messages[0]['data'] == text_data.decode('utf-8')
 
+    
+    def test_enqueue_message(self, temp_db):
+        """Test queuing messages for the background writer."""
+        storage, _ = temp_db
+        
+        assert storage.enqueue_message("192.168.1.100", 54321, b"Message 1")
+        assert storage.enqueue_message("192.168.1.101", 54322, b"Message 2")
+        
+        storage.flush()
+        
+        messages = storage.get_messages()
+        assert len(messages) == 2
+        assert messages[0]['client_ip'] == "192.168.1.101"
+        assert storage.dropped_count == 0
+    
+    def test_wait_for_count(self, temp_db):
+        """Test waiting until the background writer has stored messages."""
+        storage, _ = temp_db
+        
+        assert storage.wait_for_count(1, timeout=0.01) is False
+        
+        for i in range(3):
+            storage.enqueue_message("192.168.1.100", 54321, f"Message {i}".encode())
+        
+        assert storage.wait_for_count(3, timeout=2) is True
+        assert storage.get_message_count() == 3
+    
+    def test_enqueue_message_queue_full(self, temp_db, monkeypatch):
+        """Test messages are dropped and counted when the queue is full."""
+        import queue
+        storage, _ = temp_db
+        
+        # Use a tiny queue with no writer draining it
+        monkeypatch.setattr(storage, "start_writer", lambda: None)
+        storage.ingest_q = queue.Queue(maxsize=1)
+        
+        assert storage.enqueue_message("192.168.1.100", 54321, b"Message 1") is True
+        assert storage.enqueue_message("192.168.1.101", 54322, b"Message 2") is False
+        assert storage.dropped_count == 1
+    
+    def test_delete_old_messages_in_batches(self, temp_db, monkeypatch):
+        """Test old messages are deleted across several bounded batches."""
+        from udpmonitor import storage as storage_module
+        storage, _ = temp_db
+        monkeypatch.setattr(storage_module, "DELETE_BATCH_SIZE", 2)
+        
+        for i in range(5):
+            storage.store_message("192.168.1.100", 54321, f"Message {i}".encode())
+        
+        deleted = storage.delete_old_messages(days=0.0)
+        
+        assert deleted == 5
+        assert storage.get_message_count() == 0
+    
+    def test_migrate_text_timestamps(self, tmp_path):
+        """Test databases with ISO-8601 text timestamps are converted to integers."""
+        import sqlite3
+        db_path = str(tmp_path / "old.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("""
+            CREATE TABLE messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                client_ip TEXT NOT NULL,
+                client_port INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                data_text TEXT,
+                data_size INTEGER NOT NULL
+            )
+        """)
+        conn.execute(
+            "INSERT INTO messages (timestamp, client_ip, client_port, data, data_text, data_size) "
+            "VALUES ('2024-01-01T12:00:00.123456', '192.168.1.100', 54321, X'4869', 'Hi', 2)"
+        )
+        conn.execute(
+            "INSERT INTO messages (timestamp, client_ip, client_port, data, data_text, data_size) "
+            "VALUES ('2024-01-01T12:00:01', '192.168.1.101', 54322, X'4869', 'Hi', 2)"
+        )
+        conn.commit()
+        conn.close()
+        
+        storage = MessageStorage(db_path=db_path)
+        messages = storage.get_messages()
+        count = storage.get_message_count()
+        storage.close()
+        
+        # The maintained row count is seeded from the existing rows
+        assert count == 2
+        
+        conn = sqlite3.connect(db_path)
+        columns = [column[1] for column in conn.execute("PRAGMA table_info(messages)")]
+        conn.close()
+        assert 'data_text' not in columns
+        
+        assert [msg['timestamp'] for msg in messages] == [
+            "2024-01-01T12:00:01",
+            "2024-01-01T12:00:00.123456",
+        ]
+        assert messages[1]['client_ip'] == "192.168.1.100"
+        assert messages[1]['data'] == "Hi"
+    
+    def test_get_messages_filter_by_ip_and_port(self, temp_db):
+        """Test filtering messages by both IP and port."""
+        storage, _ = temp_db
+        
+        storage.store_message("192.168.1.100", 54321, b"Message 1")
+        storage.store_message("192.168.1.100", 54322, b"Message 2")
+        storage.store_message("192.168.1.101", 54321, b"Message 3")
+        
+        messages = storage.get_messages(client_ip="192.168.1.100", client_port=54321)
+        
+        assert len(messages) == 1
+        assert messages[0]['data'] == "Message 1"
+    
+    def test_get_message_by_id(self, temp_db):
+        """Test retrieving a single message by ID."""
+        storage, _ = temp_db
+        
+        message_id = storage.store_message("192.168.1.100", 54321, b"Hello")
+        
+        message = storage.get_message_by_id(message_id)
+        assert message['id'] == message_id
+        assert message['client_ip'] == "192.168.1.100"
+        assert message['data'] == "Hello"
+        assert message == storage.get_messages()[0]
+        
+        assert storage.get_message_by_id(message_id + 1) is None
+    
+    def test_filtered_query_uses_index_order(self, temp_db):
+        """Test filtering by IP and port reads the index in order without sorting."""
+        from udpmonitor.storage import _SELECT_MESSAGES
+        storage, _ = temp_db
+        
+        plan = storage._conn().execute(
+            "EXPLAIN QUERY PLAN " + _SELECT_MESSAGES[(True, True)],
+            ("192.168.1.100", 54321, 10, 0)
+        ).fetchall()
+        details = " ".join(row['detail'] for row in plan)
+        
+        assert "idx_ip_port_ts" in details
+        assert "TEMP B-TREE" not in details
+    
+    def test_get_messages_offset_without_limit(self, temp_db):
+        """Test an offset can be used without a limit."""
+        storage, _ = temp_db
+        
+        for i in range(5):
+            storage.store_message(f"192.168.1.{i}", 54321, f"Message {i}".encode())
+        
+        messages = storage.get_messages(offset=3)
+        
+        assert len(messages) == 2
@@ -3,16 +3,19 @@ Tests for UDP client functionality.
 """
 
 import pytest
+import logging
+import os
 import socket
-import time
+import sys
 import threading
-from udpmonitor import UDPListener, MessageStorage
+from udpmonitor import UDPListener, MessageStorage, mmsg
+from udpmonitor.udp_listener import exclude_cpu
 
 
 @pytest.fixture
-def udp_listener(temp_db):
+def udp_listener(file_db):
     """Create a UDP listener for testing."""
-    storage, db_path = temp_db
+    storage, db_path = file_db
     
     # Use a fixed port for testing (in real tests, you might want to use ephemeral ports)
     test_port = 18888
@@ -24,14 +27,12 @@ def udp_listener(temp_db):
     )
     
     listener.start()
-    
-    # Wait a moment for listener to start
-    time.sleep(0.2)
+    assert listener.ready.wait(timeout=2), "UDP listener did not start"
     
     yield listener, test_port, storage, db_path
     
+    # stop() joins the receive thread, which closes the socket
     listener.stop()
-    time.sleep(0.1)  # Give it time to stop
 
 
 class TestUDPClient:
@@ -56,6 +57,7 @@ class TestUDPClient:
         assert response[5:] == message
         
         # Verify message was stored
+        storage.flush()
         messages = storage.get_messages()
         assert len(messages) == 1
         assert messages[0]['data'] == message.decode('utf-8')
@@ -74,14 +76,11 @@ class TestUDPClient:
         
         for msg in test_messages:
             sock.sendto(msg, ('127.0.0.1', port))
-            time.sleep(0.1)  # Small delay between messages
         
         sock.close()
         
-        # Wait for processing
-        time.sleep(0.5)
-        
         # Verify all messages were stored
+        assert storage.wait_for_count(len(test_messages), timeout=2)
         messages = storage.get_messages()
         assert len(messages) == len(test_messages)
     
@@ -103,6 +102,7 @@ class TestUDPClient:
         assert response[5:] == binary_data
         
         # Verify binary message was stored
+        storage.flush()
         messages = storage.get_messages()
         assert len(messages) == 1
         assert messages[0]['data_size'] == len(binary_data)
@@ -116,10 +116,8 @@ class TestUDPClient:
         sock.sendto(message, ('127.0.0.1', port))
         sock.close()
         
-        # Wait for processing
-        time.sleep(0.2)
-        
         # Verify metadata
+        assert storage.wait_for_count(1, timeout=2)
         messages = storage.get_messages()
         assert len(messages) == 1
         
@@ -173,10 +171,214 @@ class TestUDPClient:
         for thread in threads:
             thread.join()
         
-        # Wait for processing
-        time.sleep(0.5)
-        
         # Verify all messages were stored
+        assert storage.wait_for_count(10, timeout=2)
         messages = storage.get_messages()
         assert len(messages) == 10
 
+    
+    def test_echo_without_batch_syscalls(self, file_db, monkeypatch):
+        """Test the recvfrom()/sendmsg() path used when recvmmsg() is unavailable."""
+        storage, _ = file_db
+        monkeypatch.setattr(mmsg, "AVAILABLE", False)
+        
+        port = 18889
+        listener = UDPListener(host='127.0.0.1', port=port, storage=storage)
+        listener.start()
+        assert listener.ready.wait(timeout=2)
+        
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.settimeout(2)
+            sock.sendto(b"Fallback", ('127.0.0.1', port))
+            response, _ = sock.recvfrom(4096)
+            sock.close()
+            
+            assert response == b"ECHO:Fallback"
+            
+            storage.flush()
+            assert storage.get_message_count() == 1
+        finally:
+            listener.stop()
+    
+    def test_dropped_messages_not_echoed(self, udp_listener, monkeypatch):
+        """Test datagrams the storage queue rejects get no echo and are counted."""
+        listener, port, storage, _ = udp_listener
+        enqueue = storage.enqueue_message
+        
+        def enqueue_or_drop(client_ip, client_port, data):
+            if data.startswith(b"Drop"):
+                storage.dropped_count += 1
+                return False
+            return enqueue(client_ip, client_port, data)
+        
+        monkeypatch.setattr(storage, "enqueue_message", enqueue_or_drop)
+        
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(2)
+        sock.sendto(b"Drop me", ('127.0.0.1', port))
+        sock.sendto(b"Keep me", ('127.0.0.1', port))
+        response, _ = sock.recvfrom(4096)
+        sock.close()
+        
+        assert response == b"ECHO:Keep me"
+        assert storage.dropped_count == 1
+    
+    @pytest.mark.skipif(not mmsg.AVAILABLE, reason="recvmmsg()/sendmmsg() not available")
+    def test_echo_batch_stops_on_full_send_buffer(self, monkeypatch):
+        """Test EAGAIN ends the whole echo batch after one sendmmsg() call."""
+        import ctypes
+        import errno
+        calls = []
+        
+        def sendmmsg_eagain(fd, msgs, count, flags):
+            calls.append(count)
+            ctypes.set_errno(errno.EAGAIN)
+            return -1
+        
+        monkeypatch.setattr(mmsg, "_sendmmsg", sendmmsg_eagain)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            echo_batch = mmsg.EchoBatch(mmsg.RecvBatch(), b"ECHO:")
+            with pytest.raises(BlockingIOError):
+                echo_batch.send(sock, 10)
+        finally:
+            sock.close()
+        
+        assert calls == [10]
+    
+    @pytest.mark.skipif(not mmsg.AVAILABLE, reason="recvmmsg()/sendmmsg() not available")
+    def test_full_send_buffer_drops_echo_quietly(self, udp_listener, monkeypatch, caplog):
+        """Test EAGAIN from the echo send is treated as a drop, not warned about."""
+        import ctypes
+        import errno
+        listener, port, storage, _ = udp_listener
+        
+        def sendmmsg_eagain(fd, msgs, count, flags):
+            ctypes.set_errno(errno.EAGAIN)
+            return -1
+        
+        monkeypatch.setattr(mmsg, "_sendmmsg", sendmmsg_eagain)
+        
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.sendto(b"No echo", ('127.0.0.1', port))
+        sock.close()
+        
+        assert storage.wait_for_count(1, timeout=2)
+        assert not [record for record in caplog.records if record.levelno >= logging.WARNING]
+    
+    @pytest.mark.skipif(not mmsg.AVAILABLE, reason="recvmmsg()/sendmmsg() not available")
+    def test_batch_echo_resumes_after_drop(self, file_db, monkeypatch):
+        """Test a batch with drops does not switch later batches off sendmmsg()."""
+        storage, _ = file_db
+        listener = UDPListener(host='127.0.0.1', port=18892, storage=storage)
+        results = iter([False, True])
+        monkeypatch.setattr(listener, "_store", lambda data, addr: next(results))
+        batches = iter([[(b"Drop", ('127.0.0.1', 1))], [(b"Keep", ('127.0.0.1', 1))]])
+        
+        def receive(batch):
+            for packets in batches:
+                return packets
+            raise BlockingIOError()
+        
+        echoes = []
+        monkeypatch.setattr(listener, "_receive", receive)
+        monkeypatch.setattr(listener, "_echo", lambda packets, echo_batch: echoes.append((packets, echo_batch)))
+        
+        echo_batch = object()
+        listener.running = True
+        listener._drain(None, echo_batch)
+        
+        assert echoes == [([], None), ([(b"Keep", ('127.0.0.1', 1))], echo_batch)]
+    
+    def test_store_error_not_reported_as_queue_full(self, file_db, monkeypatch, caplog):
+        """Test a datagram that failed to store is not echoed or warned about as a queue drop."""
+        storage, _ = file_db
+        listener = UDPListener(host='127.0.0.1', port=18893, storage=storage)
+        
+        def store_fails(data, addr):
+            raise ValueError("bad datagram")
+        
+        batches = iter([[(b"Bad", ('127.0.0.1', 1))]])
+        
+        def receive(batch):
+            for packets in batches:
+                return packets
+            raise BlockingIOError()
+        
+        echoes = []
+        monkeypatch.setattr(listener, "_store", store_fails)
+        monkeypatch.setattr(listener, "_receive", receive)
+        monkeypatch.setattr(listener, "_echo", lambda packets, echo_batch: echoes.append(packets))
+        
+        listener.running = True
+        listener._drain(None, None)
+        
+        assert echoes == [[]]
+        assert "queue full" not in caplog.text
+    
+    @pytest.mark.skipif(not sys.platform.startswith('linux'), reason="Linux buffer size reporting")
+    def test_buffer_cap_warning(self, file_db, capsys):
+        """Test a buffer capped between half and all of the request is reported."""
+        storage, _ = file_db
+        listener = UDPListener(host='127.0.0.1', port=18894, storage=storage)
+        
+        class CappingSocket:
+            def setsockopt(self, level, option, value):
+                # rmem_max of 3/4 of the request, reported doubled like Linux
+                self.value = 2 * (value * 3 // 4)
+            
+            def getsockopt(self, level, option):
+                return self.value
+        
+        listener.sock = CappingSocket()
+        listener._set_buffer_size(socket.SO_RCVBUF, 4096, "receive")
+        
+        assert "receive buffer capped at 3072 bytes" in capsys.readouterr().out
+    
+    def test_stop_writes_queued_messages(self, file_db):
+        """Test stop() returns only once queued messages are in the database."""
+        storage, _ = file_db
+        listener = UDPListener(host='127.0.0.1', port=18891, storage=storage)
+        
+        for i in range(100):
+            listener._store(f"Message {i}".encode(), ('127.0.0.1', 40000))
+        listener.stop()
+        
+        assert storage.get_message_count() == 100
+    
+    @pytest.mark.skipif(not hasattr(os, 'sched_getaffinity'), reason="CPU affinity not supported")
+    def test_listener_pinned_to_cpu(self, file_db):
+        """Test that the receive thread pins itself to the requested CPU."""
+        storage, _ = file_db
+        all_cpus = os.sched_getaffinity(0)
+        cpu = min(all_cpus)
+        affinity = {}
+        
+        class RecordingListener(UDPListener):
+            def _pin_thread(self):
+                super()._pin_thread()
+                affinity['cpus'] = os.sched_getaffinity(0)
+        
+        listener = RecordingListener(host='127.0.0.1', port=18890, storage=storage, cpu=cpu)
+        
+        def start_like_udpmonitor():
+            # UDPMonitor.start(): leave the core first, then start the listener.
+            # Done in a helper thread so the test process keeps its mask.
+            exclude_cpu(cpu)
+            listener.start()
+        
+        starter = threading.Thread(target=start_like_udpmonitor)
+        starter.start()
+        starter.join()
+        assert listener.ready.wait(timeout=2)
+        listener.stop()
+        
+        assert affinity['cpus'] == {cpu}
+        # The storage writer must not share the listener's core or priority
+        writer_tid = storage._writer_thread.native_id
+        if len(all_cpus) > 1:
+            assert cpu not in os.sched_getaffinity(writer_tid)
+        assert os.getpriority(os.PRIO_PROCESS, writer_tid) == os.getpriority(os.PRIO_PROCESS, 0)
+        # Pinning the listener thread must not affect the rest of the process
+        assert cpu in os.sched_getaffinity(0)
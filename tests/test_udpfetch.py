@@ -8,7 +8,7 @@ from udpmonitor.udpfetch import Message
 
 
 class TestMessage:
-    """Tests for the Message dataclass."""
+    """Tests for the Message type."""
     
     def test_message_creation(self):
         """Test creating a Message object."""
@@ -29,6 +29,16 @@ class TestMessage:
         assert msg.data == b"Hello, World!"
         assert msg.data_size == 13
     
+    def test_message_is_immutable_tuple(self):
+        """Test Message instances have no __dict__, cannot be modified and unpack like rows."""
+        row = (1, "2024-01-01T12:00:00", "192.168.1.100", 54321, "Hi", b"Hi", 2)
+        msg = Message._make(row)
+        
+        assert not hasattr(msg, '__dict__')
+        with pytest.raises(AttributeError):
+            msg.ip = "10.0.0.1"
+        assert tuple(msg) == row
+    
     def test_message_repr(self):
         """Test Message string representation."""
         msg = Message(
@@ -110,6 +120,47 @@ class TestUDPFetch:
         assert messages[0].ip == "192.168.1.101"
         assert messages[0].port == 54322
     
+    def test_get_messages_newest_first(self, sample_file_messages):
+        """Test messages are returned most recently received first."""
+        _, db_path, expected_messages = sample_file_messages
+        
+        messages = udpfetch.get_messages(db_path=db_path)
+        
+        assert [msg.data for msg in messages] == [data for _, _, data in reversed(expected_messages)]
+        assert [msg.id for msg in messages] == sorted((msg.id for msg in messages), reverse=True)
+    
+    def test_get_messages_lazy(self, sample_messages):
+        """Test eager=False defers loading payloads until they are accessed."""
+        storage, db_path, _ = sample_messages
+        
+        eager = udpfetch.get_messages(db_path=db_path)
+        lazy = udpfetch.get_messages(db_path=db_path, eager=False)
+        
+        assert len(lazy) == len(eager)
+        assert lazy[0]._data is None
+        for lazy_msg, msg in zip(lazy, eager):
+            assert (lazy_msg.id, lazy_msg.timestamp, lazy_msg.ip, lazy_msg.port, lazy_msg.data_size) == \
+                (msg.id, msg.timestamp, msg.ip, msg.port, msg.data_size)
+            assert lazy_msg.data == msg.data
+            assert lazy_msg.message == msg.message
+        
+        # A payload deleted before it is loaded can no longer be read
+        stale = udpfetch.get_messages(db_path=db_path, eager=False)[0]
+        storage.clear_messages()
+        with pytest.raises(LookupError):
+            stale.data
+        # repr() shows what is loaded without querying the database
+        assert "<not loaded>" in repr(stale)
+        assert "Hello, World!" in repr(lazy[-1])
+    
+    def test_get_messages_zero_values_are_not_unset(self, sample_messages):
+        """Test limit=0 and client_port=0 are applied rather than ignored."""
+        _, db_path, _ = sample_messages
+        
+        assert udpfetch.get_messages(limit=0, db_path=db_path) == []
+        assert udpfetch.get_messages(client_port=0, db_path=db_path) == []
+        assert udpfetch.get_messages(client_ip="", db_path=db_path) == []
+    
     def test_get_message_count_empty(self, temp_db):
         """Test getting message count from empty database."""
         _, db_path = temp_db
@@ -124,6 +175,33 @@ class TestUDPFetch:
         count = udpfetch.get_message_count(db_path=db_path)
         assert count == 4
     
+    def test_get_message_count_without_meta_table(self, tmp_path):
+        """Test counting a database written before the _meta table existed."""
+        import sqlite3
+        db_path = str(tmp_path / "old.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("""
+            CREATE TABLE messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp INTEGER NOT NULL,
+                client_ip TEXT NOT NULL,
+                client_port INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                data_size INTEGER NOT NULL
+            )
+        """)
+        conn.executemany(
+            "INSERT INTO messages (timestamp, client_ip, client_port, data, data_size) VALUES (?, ?, ?, ?, ?)",
+            [(0, "10.0.0.1", 1, b"a", 1), (1, "10.0.0.2", 2, b"b", 1)]
+        )
+        conn.commit()
+        conn.close()
+        
+        try:
+            assert udpfetch.get_message_count(db_path=db_path) == 2
+        finally:
+            udpfetch.close_connections()
+    
     def test_get_latest_message_empty(self, temp_db):
         """Test getting latest message from empty database."""
         _, db_path = temp_db
@@ -182,6 +260,155 @@ class TestUDPFetch:
         
         assert len(messages) == 1
         assert messages[0].data == binary_data
-        # Binary data should be represented as hex
+        # Binary data is decoded with invalid UTF-8 replaced by U+FFFD
         assert isinstance(messages[0].message, str)
+        assert "\ufffd" in messages[0].message
 
+    
+    def test_connection_reused(self, sample_file_messages):
+        """Test repeated calls share one cached connection per thread."""
+        _, db_path, _ = sample_file_messages
+        
+        conn = udpfetch._get_conn(db_path)
+        udpfetch.get_messages(db_path=db_path)
+        udpfetch.get_message_count(db_path=db_path)
+        assert udpfetch._get_conn(db_path) is conn
+        
+        udpfetch.close_connections()
+        assert udpfetch._get_conn(db_path) is not conn
+        assert udpfetch.get_message_count(db_path=db_path) == 4
+    
+    def test_compiled_builder_matches_python(self):
+        """Test the optional compiled row builder gives the same Messages as the Python one."""
+        _udpfetch_c = pytest.importorskip("udpmonitor._udpfetch_c")
+        rows = [
+            (1, 1704110400123456, "192.168.1.100", 54321, b"Hello", 5),
+            (2, 1704110400000000, "10.0.0.1", 12345, b"\x00\xff\xfe", 3),
+            (3, 951782400000001, "10.0.0.2", 1, "Grüße".encode(), 7),
+        ]
+        
+        expected = udpfetch._build_messages_py(rows, Message._make)
+        assert _udpfetch_c.build_messages(rows, Message._make) == expected
+        
+        # A non-BLOB payload is rejected the same way, never read as bytes
+        text_row = [(4, 0, "10.0.0.3", 2, "text payload", 12)]
+        with pytest.raises(AttributeError):
+            udpfetch._build_messages_py(text_row, Message._make)
+        with pytest.raises(AttributeError):
+            _udpfetch_c.build_messages(text_row, Message._make)
+    
+    def test_connection_is_read_only(self, sample_file_messages):
+        """Test udpfetch connections cannot modify the database."""
+        import sqlite3
+        _, db_path, _ = sample_file_messages
+        
+        conn = udpfetch._get_conn(db_path)
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM messages")
+        # Opened with mode=ro: still read-only with query_only switched off
+        conn.execute("PRAGMA query_only=0")
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM messages")
+        conn.execute("PRAGMA query_only=1")
+        assert udpfetch.get_message_count(db_path=db_path) == 4
+    
+    def test_get_messages_arrow(self, sample_file_messages, monkeypatch):
+        """Test fetching messages as an Arrow table through sqlite3."""
+        pytest.importorskip("pyarrow")
+        _, db_path, expected_messages = sample_file_messages
+        # The DuckDB path is covered by test_get_messages_arrow_duckdb
+        monkeypatch.setattr(udpfetch, "_duckdb_failed", True)
+        
+        table = udpfetch.get_messages_arrow(db_path=db_path)
+        messages = udpfetch.get_messages(db_path=db_path)
+        
+        assert table.column_names == ['id', 'timestamp', 'client_ip', 'client_port', 'data', 'data_size']
+        assert table.column('id').to_pylist() == [msg.id for msg in messages]
+        assert table.column('data').to_pylist() == [msg.data for msg in messages]
+        assert [ts.isoformat() for ts in table.column('timestamp').to_pylist()] == \
+            [msg.timestamp for msg in messages]
+        
+        filtered = udpfetch.get_messages_arrow(db_path=db_path, client_ip="10.0.0.1", limit=1)
+        assert filtered.column('client_port').to_pylist() == [12345]
+    
+    def test_get_messages_cached_until_database_changes(self, sample_file_messages):
+        """Test repeated bounded polls are served from the cache until a write."""
+        storage, db_path, _ = sample_file_messages
+        
+        first = udpfetch.get_messages(limit=10, db_path=db_path)
+        second = udpfetch.get_messages(limit=10, db_path=db_path)
+        
+        assert second == first
+        assert second is not first
+        # Served from the cache: the very same Message objects
+        assert second[0] is first[0]
+        cached = len(udpfetch._cache)
+        
+        storage.store_message("10.0.0.9", 9999, b"New message")
+        
+        third = udpfetch.get_messages(limit=10, db_path=db_path)
+        assert len(third) == len(first) + 1
+        assert third[0].data == b"New message"
+        # The stale result is replaced, not kept alongside the new one
+        assert len(udpfetch._cache) == cached
+    
+    def test_large_limits_not_cached(self, sample_messages):
+        """Test results bigger than CACHE_MAX_ROWS are never cached."""
+        _, db_path, _ = sample_messages
+        udpfetch.close_connections()
+        
+        first = udpfetch.get_messages(limit=udpfetch.CACHE_MAX_ROWS + 1, db_path=db_path)
+        second = udpfetch.get_messages(limit=udpfetch.CACHE_MAX_ROWS + 1, db_path=db_path)
+        
+        assert second == first
+        assert second[0] is not first[0]
+        assert udpfetch._cache == {}
+    
+    def test_exited_threads_release_connections(self, file_db):
+        """Test connections opened by short-lived threads are closed when the threads exit."""
+        import os
+        import threading
+        if not os.path.isdir('/proc/self/fd'):
+            pytest.skip("needs /proc/self/fd")
+        _, db_path = file_db
+        
+        def fd_count():
+            return len(os.listdir('/proc/self/fd'))
+        
+        udpfetch.get_message_count(db_path=db_path)
+        before = fd_count()
+        for _ in range(50):
+            thread = threading.Thread(target=udpfetch.get_message_count, kwargs={'db_path': db_path})
+            thread.start()
+            thread.join()
+        
+        # The last thread may still be tearing down its thread-locals
+        assert fd_count() <= before + 2
+        assert len(udpfetch._pools) <= 2
+    
+    def test_get_messages_arrow_duckdb(self, file_db, monkeypatch):
+        """Test the DuckDB path returns the same rows, in the same order, as get_messages()."""
+        pytest.importorskip("pyarrow")
+        duckdb = pytest.importorskip("duckdb")
+        try:
+            with duckdb.connect() as conn:
+                # Only check for an installed copy; don't download it here
+                conn.execute("SET autoinstall_known_extensions=false")
+                conn.execute("LOAD sqlite")
+        except duckdb.Error:
+            pytest.skip("DuckDB sqlite extension not installed")
+        storage, db_path = file_db
+        for ip, port, data in [("10.0.0.1", 1, b"a"), ("10.0.0.2", 2, b"b"), ("10.0.0.1", 1, b"c")]:
+            storage.store_message(ip, port, data)
+        expected = udpfetch.get_messages(db_path=db_path)
+        expected_filtered = udpfetch.get_messages(db_path=db_path, client_ip="10.0.0.1")
+        
+        # Fail if the sqlite3 fallback is used
+        monkeypatch.setattr(udpfetch, "_duckdb_failed", False)
+        monkeypatch.setattr(udpfetch, "_get_conn", None)
+        table = udpfetch.get_messages_arrow(db_path=db_path)
+        filtered = udpfetch.get_messages_arrow(db_path=db_path, client_ip="10.0.0.1")
+        
+        assert table.column('id').to_pylist() == [msg.id for msg in expected]
+        assert table.column('data').to_pylist() == [msg.data for msg in expected]
+        assert filtered.column('id').to_pylist() == [msg.id for msg in expected_filtered]